@@ -0,0 +1,46 @@
+'''Choice of the arm motion profile from the move and the hive around it'''
+
+import numpy as np
+
+from skills.hive_selection.arms import (ARM_MOTION_PROFILES,
+                                        ARM_TRANSIT_MIN_DISTANCE,
+                                        ARM_TRANSIT_MIN_CLEARANCE,
+                                        ARM_FINAL_APPROACH_DISTANCE)
+
+
+def motion_profile(name):
+    '''Velocity and acceleration scaling of profile `name`'''
+    return dict(ARM_MOTION_PROFILES[name])
+
+
+
+def choose_motion_profile(move_distance, clearance = np.inf):
+    '''
+    INPUTS:
+        move_distance - distance the gripper has to travel (meters)
+        clearance - distance from the gripper to the hive (meters)
+
+    OUTPUTS:
+        'transit' for long moves away from the hive, 'pre_grasp' otherwise
+    '''
+    if move_distance >= ARM_TRANSIT_MIN_DISTANCE and \
+            clearance >= ARM_TRANSIT_MIN_CLEARANCE:
+        return 'transit'
+    return 'pre_grasp'
+
+
+
+def hive_clearance(position, hive_points):
+    '''Distance from `position` to the closest known point of the hive'''
+    hive_points = np.asarray(hive_points, dtype = float).reshape(-1, 3)
+    if len(hive_points) == 0:
+        return np.inf
+    return float(np.min(np.linalg.norm(
+                    hive_points - np.asarray(position[:3], dtype = float),
+                    axis = 1)))
+
+
+
+def pre_grasp_pose(pose, distance = ARM_FINAL_APPROACH_DISTANCE):
+    '''`pose` backed off `distance` away from the hive (along -x)'''
+    return {**pose, 'x' : pose['x'] - distance}
@@ -0,0 +1,51 @@
+'''Choice of the arm(s) picking each target, from the arm profiles'''
+
+import numpy as np
+
+from skills.hive_selection.arms import (ARM_PROFILES, ARM_MAX_REACH,
+                                        DUAL_ARM_ROW_TOLERANCE,
+                                        DUAL_ARM_MIN_SEPARATION,
+                                        DUAL_ARM_MAX_SEPARATION)
+
+
+def reach_distance(arm, position):
+    '''Distance (meters) from the shoulder of `arm` to `position`'''
+    return float(np.linalg.norm(np.asarray(position[:3], dtype = float) -
+                                ARM_PROFILES[arm]['shoulder']))
+
+
+
+def nearest_arm(position, arms = None):
+    '''Arm with the shortest reach to `position` (base link)'''
+    arms = list(arms or ARM_PROFILES)
+    return min(arms, key = lambda arm: reach_distance(arm, position))
+
+
+
+def pair_targets(target, candidates):
+    '''
+    INPUTS:
+        target - xyz of the chosen target (base link)
+        candidates - xyz of every visible target, may include `target`
+
+    OUTPUTS:
+        Dict {'right_arm' : xyz, 'left_arm' : xyz} with `target` and the
+        closest candidate in the same row and a neighbouring cell, each one
+        given to the arm on its side. None if no candidate fits both arms.
+    '''
+    target = np.asarray(target[:3], dtype = float)
+    candidates = np.asarray(candidates, dtype = float).reshape(-1, 3)
+    depth = np.abs(candidates[:, 0] - target[0])
+    gap = np.abs(candidates[:, 1] - target[1])
+    fits = (depth <= DUAL_ARM_ROW_TOLERANCE) & \
+           (gap >= DUAL_ARM_MIN_SEPARATION) & \
+           (gap <= DUAL_ARM_MAX_SEPARATION)
+
+    for candidate in candidates[fits][np.argsort(gap[fits])]:
+        # The right arm takes the rightmost target (lowest y)
+        right, left = (target, candidate) if target[1] <= candidate[1] \
+                        else (candidate, target)
+        if reach_distance('right_arm', right) <= ARM_MAX_REACH and \
+                reach_distance('left_arm', left) <= ARM_MAX_REACH:
+            return {'right_arm' : right.tolist(), 'left_arm' : left.tolist()}
+    return None
@@ -0,0 +1,59 @@
+'''Tracks the last commanded arm move to skip the redundant ones'''
+
+import numpy as np
+
+from skills.hive_selection.arms import ARM_ERROR_THRESHOLD
+
+
+class ArmStateTracker:
+    '''
+    Remembers the last move commanded to the arm: its name, its target (pose
+    or joints) and the position measured once it finished. A new move with
+    the same name and target can be skipped when the arm is still measured
+    at that position.
+    '''
+
+    def __init__(self, tolerance = ARM_ERROR_THRESHOLD):
+        self.tolerance = np.array(tolerance)
+        self.moves_commanded = 0
+        self.moves_skipped = 0
+        self.invalidate()
+
+
+    def invalidate(self):
+        '''Forget the arm state (unknown/partial moves)'''
+        self.last_move = None
+        self.last_target = None
+        self.last_measured = None
+
+
+    def commanded(self):
+        '''Count a move about to be commanded, the state is unknown until then'''
+        self.moves_commanded += 1
+        self.invalidate()
+
+
+    def record(self, move, target, measured):
+        '''Store a move that finished, with the position measured after it'''
+        self.last_move = move
+        self.last_target = None if target is None else np.array(target)
+        self.last_measured = np.array(measured)
+
+
+    def matches(self, move, target = None):
+        '''Whether `move` (to `target`) is the last move that was commanded'''
+        if self.last_move != move or self.last_measured is None:
+            return False
+        if target is None or self.last_target is None:
+            return target is None and self.last_target is None
+        target = np.array(target)
+        return target.shape == self.last_target.shape and \
+               bool(np.all(np.abs(target - self.last_target) <= 1e-3))
+
+
+    def reached(self, measured):
+        '''Whether the arm is still where the last move left it'''
+        if self.last_measured is None:
+            return False
+        delta = np.abs(np.array(measured) - self.last_measured)
+        return bool(np.all(delta <= self.tolerance))
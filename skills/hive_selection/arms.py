@@ -33,3 +33,54 @@ RIGHT_ARM_OFFSET = {'x' : -0.04,
 
 ARM_ERROR_THRESHOLD = [0.03, 0.03, 0.03]
 
+
+
+# Kinematic profile of each arm. Only the right arm is calibrated on the
+# robot; the left arm is mirrored from it (y offset and wrist angle), and the
+# shoulder positions are estimates. Arm selection and dual picking rely on
+# them, so they need the 'provisional_arm_profiles' setup arg.
+ARM_PROFILES = {
+    'right_arm' : {
+        'joint_names' : JOINT_NAMES,
+        'rail_joint' : 'arm_right_shoulder_rail_joint',
+        'trex_angles' : TREX_POSITION_ANGLES,
+        'offset' : RIGHT_ARM_OFFSET,
+        'shoulder' : [0.10, -0.20, 0.95],   # Shoulder in base link (meters)
+        'calibrated' : True,
+    },
+
+    'left_arm' : {
+        'joint_names' : [name.replace('_right_', '_left_')
+                         for name in JOINT_NAMES],
+        'rail_joint' : 'arm_left_shoulder_rail_joint',
+        'trex_angles' : TREX_POSITION_ANGLES[:-1] + \
+                        [-TREX_POSITION_ANGLES[-1]],
+        'offset' : {'x' : RIGHT_ARM_OFFSET['x'],
+                    'y' : -RIGHT_ARM_OFFSET['y'],
+                    'z' : RIGHT_ARM_OFFSET['z']},
+        'shoulder' : [0.10, 0.20, 0.95],
+        'calibrated' : False,
+    },
+}
+
+ARM_MAX_REACH = 0.85                # Shoulder to gripper pose (meters),
+                                    # provisional: not measured on the robot
+
+# Dual arm picking: targets must be in the same row, in neighbouring cells
+# and far enough apart for both grippers
+DUAL_ARM_ROW_TOLERANCE = 0.03       # Max depth difference (meters)
+DUAL_ARM_MIN_SEPARATION = 0.08      # Min sideways gap (meters)
+DUAL_ARM_MAX_SEPARATION = 0.15      # Max sideways gap (meters)
+
+# Arm motion profiles (velocity and acceleration scaling)
+ARM_MOTION_PROFILES = {
+    'transit' : {'velocity_scaling' : 0.6, 'acceleration_scaling' : 0.5},
+    'pre_grasp' : {'velocity_scaling' : 0.3, 'acceleration_scaling' : 0.3},
+    'insertion' : {'velocity_scaling' : 0.1, 'acceleration_scaling' : 0.1},
+    'retreat' : {'velocity_scaling' : 0.4, 'acceleration_scaling' : 0.4},
+}
+ARM_TRANSIT_MIN_DISTANCE = 0.15     # Shorter moves don't need transit speed
+ARM_TRANSIT_MIN_CLEARANCE = 0.10    # Arm closer to the hive moves carefully
+ARM_FINAL_APPROACH_DISTANCE = 0.05  # Slow last stretch into the cell (meters)
+ARM_EXTRACTION_DISTANCE = 0.13      # Pull back out of the cell (its depth and
+                                    # the final approach) before base moves
@@ -0,0 +1,67 @@
+'''Base speeds chosen from the lidar clearance around each move'''
+
+import numpy as np
+
+from skills.hive_selection.constants import (BASE_LINEAR_SPEED_MIN,
+                                             BASE_LINEAR_SPEED_MAX,
+                                             BASE_LINEAR_CLEARANCE_MIN,
+                                             BASE_LINEAR_CLEARANCE_MAX,
+                                             BASE_STOP_MARGIN,
+                                             BASE_ANGULAR_SPEED_MIN,
+                                             BASE_ANGULAR_SPEED_MAX,
+                                             BASE_ANGULAR_SPEED_DEFAULT,
+                                             BASE_ROTATION_CLEARANCE_MIN,
+                                             BASE_ROTATION_CLEARANCE_MAX,
+                                             ROBOT_FOOTPRINT)
+
+
+def linear_speed(clearance, distance = 0.0, max_speed = BASE_LINEAR_SPEED_MAX):
+    '''
+    INPUTS:
+        clearance - free distance along the path of the move (meters), None
+                    if it couldn't be measured
+        distance - length of the move (meters)
+        max_speed - cap for this move (m/s)
+
+    OUTPUTS:
+        Speed (m/s, positive) from the minimum when the path is short of
+        BASE_LINEAR_CLEARANCE_MIN to `max_speed` when it is free for
+        BASE_LINEAR_CLEARANCE_MAX. The cautious minimum when the clearance
+        is unknown or the move ends within BASE_STOP_MARGIN of an obstacle.
+    '''
+    if clearance is None or clearance - abs(distance) < BASE_STOP_MARGIN:
+        return BASE_LINEAR_SPEED_MIN
+    return float(np.interp(clearance,
+                           [BASE_LINEAR_CLEARANCE_MIN,
+                            BASE_LINEAR_CLEARANCE_MAX],
+                           [BASE_LINEAR_SPEED_MIN, max_speed]))
+
+
+
+def rotation_radius(footprint = ROBOT_FOOTPRINT):
+    '''Radius (meters) of the circle the footprint sweeps rotating'''
+    return float(np.hypot(max(footprint['front'], footprint['back']),
+                          footprint['half_width']))
+
+
+
+def angular_speed(nearest, max_speed = BASE_ANGULAR_SPEED_MAX):
+    '''
+    INPUTS:
+        nearest - closest return of the beams present around the robot
+                  (meters, inf if they're all free), None if the scan has
+                  no beam to measure it
+        max_speed - cap for this rotation (deg/s)
+
+    OUTPUTS:
+        Rotation speed (deg/s), from the minimum when an obstacle is close
+        to the swept footprint to `max_speed` in open space.
+        BASE_ANGULAR_SPEED_DEFAULT (within the cap) when it can't be
+        measured.
+    '''
+    if nearest is None:
+        return min(BASE_ANGULAR_SPEED_DEFAULT, max_speed)
+    return float(np.interp(nearest - rotation_radius(),
+                           [BASE_ROTATION_CLEARANCE_MIN,
+                            BASE_ROTATION_CLEARANCE_MAX],
+                           [BASE_ANGULAR_SPEED_MIN, max_speed]))
@@ -0,0 +1,33 @@
+'''Enables the cameras shared by several phase resources'''
+
+
+class CameraManager:
+    '''
+    Wraps the cameras controller to count the references to each camera, so
+    several phase resources can share it (working_camera_1 and
+    working_camera_2 may be the same camera): the first one enables it and
+    the last one disables it.
+    '''
+
+    def __init__(self, cameras, log):
+        self.cameras = cameras
+        self.log = log
+        self.users = {}                     # Camera name -> references
+
+
+    async def enable(self, camera):
+        '''Enable `camera`, unless it's already enabled'''
+        if self.users.get(camera, 0) > 0:
+            self.users[camera] += 1
+            return
+        await self.cameras.enable_color_camera(camera)
+        self.users[camera] = 1
+
+
+    async def disable(self, camera):
+        '''Drop a reference to `camera`, disabling it with the last one'''
+        if self.users.get(camera, 0) > 1:
+            self.users[camera] -= 1
+            return
+        self.users.pop(camera, None)
+        await self.cameras.disable_color_camera(camera)
@@ -0,0 +1,91 @@
+'''FSM checkpoints, to resume a pick after a crash or an abort'''
+
+import json
+import os
+import time
+
+import numpy as np
+
+from skills.hive_selection.constants import (CHECKPOINT_MAX_AGE,
+                                             RESUME_STATES,
+                                             RESUME_POSE_TOLERANCE,
+                                             PICK_STATES_ORDER)
+from skills.hive_selection.navigation import (NAV_POINT_CART,
+                                              NAVIGATION_THRESHOLD)
+
+
+class CheckpointStore:
+    '''Last checkpoint of the FSM, stored as JSON'''
+
+    def __init__(self, path):
+        self.path = os.path.expanduser(path)
+
+
+    def load(self, map_name, hive_name, item_name):
+        '''Checkpoint of the same pick, None if missing or too old'''
+        try:
+            with open(self.path, 'r', encoding = 'utf-8') as file:
+                checkpoint = json.load(file)
+        except (OSError, ValueError):
+            return None
+        if (checkpoint.get('map_name'), checkpoint.get('hive_name'),
+                checkpoint.get('item_name')) != \
+                (map_name, hive_name, item_name) or \
+                time.time() - checkpoint.get('time', 0) > CHECKPOINT_MAX_AGE:
+            return None
+        return checkpoint
+
+
+    def save(self, checkpoint):
+        '''Atomically write `checkpoint`'''
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok = True)
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w', encoding = 'utf-8') as file:
+            json.dump(checkpoint, file, indent = 2, default = _to_json)
+        os.replace(tmp_path, self.path)
+
+
+    def clear(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+
+def _to_json(value):
+    return value.tolist() if hasattr(value, 'tolist') else str(value)
+
+
+
+def pose_matches(pose, reference, tolerance = RESUME_POSE_TOLERANCE):
+    '''Whether two [x, y, angle (deg)] poses are within `tolerance`'''
+    if pose is None or reference is None:
+        return False
+    distance = np.hypot(pose[0] - reference[0], pose[1] - reference[1])
+    angle = (pose[2] - reference[2] + 180.0) % 360.0 - 180.0
+    return distance <= tolerance[0] and abs(angle) <= tolerance[1]
+
+
+
+def resume_state(checkpoint, pose):
+    '''
+    INPUTS:
+        checkpoint - last checkpoint of the pick
+        pose - current robot pose [x, y, angle (deg)]
+
+    OUTPUTS:
+        Deepest state the pick can resume from. The states after the
+        approach need the robot where the checkpoint left it, the approach
+        needs it near the hive, otherwise the pick starts over.
+    '''
+    state = RESUME_STATES.get(checkpoint['state'], PICK_STATES_ORDER[0])
+    aligned = PICK_STATES_ORDER.index('DETECTING_TAGS_1')
+    if PICK_STATES_ORDER.index(state) >= aligned and \
+            not pose_matches(pose, checkpoint.get('pose')):
+        state = 'APPROACHING_HIVE'
+    if state == 'APPROACHING_HIVE' and (pose is None or np.hypot(
+            pose[0] - NAV_POINT_CART['x'], pose[1] - NAV_POINT_CART['y']) >
+            NAVIGATION_THRESHOLD):
+        state = 'NAVIGATING_TO_HIVE'
+    return state
@@ -5,6 +5,10 @@ ERROR_TAG_NOT_FOUND = (3, "Couldn't find the tag")
 ERROR_COULDNT_POSITION_ARM = (4, "Couldn't position the arm")
 ERROR_ARM_POSITION_NOT_ACCURATE = (5, 'Arm position not accurate')
 ERROR_COULDNT_PICKUP_ITEM = (6, "Couldn't pick up the item")
+ERROR_PICK_DEADLINE_EXCEEDED = (7, "Pick can't finish before its deadline")
+ERROR_PATH_BLOCKED = (8, 'Path behind the robot is blocked')
+ERROR_UNKNOWN_ITEM = (9, 'Unknown item name')
+ERROR_TOO_MANY_RESUMES = (10, 'Pick was resumed too many times')
 
 # Max attempts
 MAX_NAVIGATION_ATTEMPTS = 3
@@ -15,11 +19,205 @@ MAX_PICKUP_ATTEMPTS = 2
 # Timeouts
 NO_TARGET_TIMEOUT = 10.0
 
+# Minimum time (seconds) a state needs to be worth starting, used to abort
+# early when the pick deadline can no longer be met
+STATE_MIN_DURATIONS = {
+    'NAVIGATING_TO_HIVE' : 10.0,
+    'APPROACHING_HIVE' : 8.0,
+    'DETECTING_TAGS_1' : 2.0,
+    'MOVING_SIDEWAYS' : 6.0,
+    'DETECTING_TAGS_2' : 2.0,
+    'POSITION_ARM' : 6.0,
+    'PICK_ITEM' : 6.0,
+}
+PICK_STATES_ORDER = ['NAVIGATING_TO_HIVE',
+                     'APPROACHING_HIVE',
+                     'DETECTING_TAGS_1',
+                     'MOVING_SIDEWAYS',
+                     'DETECTING_TAGS_2',
+                     'POSITION_ARM',
+                     'PICK_ITEM']
+
+# Apriltag number of each item on the hive cells (not the approach tag)
+ITEM_TAG_IDS = {
+    'bottle' : 4,
+    'towel' : 1,
+    'pajamas' : 3,
+}
+
 # Other constants
 HIVE_NUM_ROWS = 2
 HIVE_NUM_COLS = 2
 MAX_CAMERA_PIXELS_X = 850
 
+SIDEWAYS_TAG_OFFSET = 0.32          # Sideways move past the tag's Y when the
+                                    # camera estimate is off (meters)
+
 CELL_SIZE_X = 0.08
+CELL_SIZE_Y = 0.10
 CELL_SIZE_Z = 0.05
+
+# Hive board fit (the cell sizes are the pitch between neighbouring tags)
+HIVE_FIT_MIN_TAGS = 2               # Fewer tags don't constrain the board
+HIVE_FIT_MAX_RESIDUAL = 0.02        # Max RMS error to trust the board fit
+HIVE_FIT_ITERATIONS = 3
 PICKUP_HEIGHT = 0.275
+
+# Metrics
+METRICS_PREFIX = 'hive_selection'
+METRICS_LATENCY_WINDOW = 512        # Last visits kept per state
+METRICS_QUANTILES = (0.5, 0.9, 0.99)
+
+# Concurrent arm/base motion: minimum front lidar clearance (meters) needed to
+# stage the arm while the base performs each kind of move
+CONCURRENT_MOTION_MIN_CLEARANCE = {
+    'reverse' : 0.30,
+    'rotate' : 0.60,
+}
+
+# Hive inventory
+INVENTORY_PATH = '~/.hive_selection/inventory.json'
+INVENTORY_MAX_AGE = 3600.0          # Older records are not trusted (seconds)
+INVENTORY_CONFIRMATION_TIME = 0.5   # Detection wait with a prediction (s)
+DETECTION_SCAN_TIME = 1.5           # Detection wait without one (seconds)
+
+# Debug visualisation
+VISUALIZATION_QUEUE_SIZE = 2        # Frames waiting to be drawn
+VISUALIZATION_WINDOW = 'hive_selection'
+
+# Detections subscription
+VISION_STATES = ['DEBUG_STATE', 'DETECTING_TAGS_1', 'DETECTING_TAGS_2',
+                 'PICK_ITEM']
+DETECTION_CHANGE_THRESHOLD = 0.01   # Tag motion to deliver a frame (meters)
+
+# Resources (cameras, models) each state needs, acquired/released per phase
+# in this order (and released in reverse). The tags detector runs on
+# camera_2, list it after that camera.
+PHASE_RESOURCES = {
+    'NAVIGATING_TO_HIVE' : [],
+    'APPROACHING_HIVE' : ['camera_1'],
+    'DETECTING_TAGS_1' : ['camera_2', 'tags_detector'],
+    'MOVING_SIDEWAYS' : ['camera_2', 'tags_detector'],
+    'DETECTING_TAGS_2' : ['camera_2', 'tags_detector'],
+    'POSITION_ARM' : ['camera_2', 'tags_detector'],
+    'PICK_ITEM' : ['camera_2', 'tags_detector'],
+    'DEBUG_STATE' : ['camera_2', 'tags_detector'],
+}
+
+# Lidar docking to the hive face
+LIDAR_DOCKING_SECTOR = 30.0         # Half width of the front sector (deg)
+LIDAR_DOCKING_MAX_DISTANCE = 1.5    # Face must be closer than this (meters)
+LIDAR_RANSAC_ITERATIONS = 64
+LIDAR_RANSAC_THRESHOLD = 0.015      # Inlier distance to the line (meters)
+LIDAR_RANSAC_MIN_INLIERS = 15
+LIDAR_DOCKING_DISTANCE_TOLERANCE = 0.02  # meters
+LIDAR_DOCKING_YAW_TOLERANCE = 2.0   # degrees
+LIDAR_DOCKING_MAX_STEPS = 3
+LIDAR_DOCKING_MAX_HEADING_ERROR = 10.0   # Face vs goal angle (degrees)
+LIDAR_PREDOCK_MIN_INLIERS = 40      # Face fit confident enough to drive on
+LIDAR_PREDOCK_STANDOFF = 0.30       # Left to ApproachToTags past the goal
+                                    # distance, its min_correction_distance
+LIDAR_FRONT_SECTOR = 5.0            # Half width of the front sector (deg)
+LIDAR_MIN_RANGE = 0.05              # Closer returns are invalid (meters)
+
+# Dry run estimates
+DRY_RUN_NAV_SPEED = 0.3             # Average navigation speed (m/s)
+DRY_RUN_BASE_SPEED = 0.05           # Approach/sideways linear speed (m/s)
+DRY_RUN_ANGULAR_SPEED = 10.0        # Rotation speed (deg/s)
+ESTIMATED_STATE_DURATIONS = {       # Fixed part of each state (seconds)
+    'NAVIGATING_TO_HIVE' : 5.0,
+    'APPROACHING_HIVE' : 20.0,
+    'DETECTING_TAGS_1' : 3.0,
+    'MOVING_SIDEWAYS' : 1.5,
+    'DETECTING_TAGS_2' : 3.0,
+    'POSITION_ARM' : 12.0,
+    'PICK_ITEM' : 12.0,
+}
+
+# Soak harness
+SOAK_TIME_SCALE = 0.001             # Real seconds per simulated second
+SOAK_FRAMES_PER_SECOND = 15         # Simulated camera frame rate
+SOAK_MAX_FRAMES_PER_TICK = 5        # Frames delivered per simulated sleep
+SOAK_LAG_PERIOD = 0.005             # Event loop lag probe period (seconds)
+SOAK_REGRESSION_TOLERANCE = 0.10    # Relative worsening flagged vs baseline
+
+# Base speed planner
+BASE_LINEAR_SPEED_MIN = 0.05        # Cautious speed, clearance unknown (m/s)
+BASE_LINEAR_SPEED_MAX = 0.15        # m/s
+BASE_LINEAR_CLEARANCE_MIN = 0.30    # Free path: slowest move (meters)
+BASE_LINEAR_CLEARANCE_MAX = 1.50    # Free path: fastest move (meters)
+BASE_STOP_MARGIN = 0.10             # Gap always kept to obstacles (meters)
+BASE_ANGULAR_SPEED_MIN = 10.0       # deg/s
+BASE_ANGULAR_SPEED_MAX = 30.0       # deg/s
+BASE_ANGULAR_SPEED_DEFAULT = 15.0   # Scan without returns (deg/s)
+BASE_ANGULAR_SPEED_HIVE = 10.0      # Cap facing the hive (deg/s)
+BASE_ANGULAR_SPEED_SIDEWAYS = 15.0  # Cap of the sideways turns (deg/s)
+BASE_ROTATION_CLEARANCE_MIN = 0.05  # Gap to the swept footprint: slowest
+BASE_ROTATION_CLEARANCE_MAX = 0.60  # rotation to fastest rotation (meters)
+BASE_APPROACH_SPEED_MAX = 0.10      # Camera approach cap, keeps tags sharp
+
+# Swept path check for moves without obstacle avoidance
+ROBOT_FOOTPRINT = {                 # Robot outline in the lidar frame (m)
+    'front' : 0.20,
+    'back' : 0.40,
+    'half_width' : 0.30,
+}
+SWEPT_PATH_MARGIN = 0.05            # Extra room around the footprint (m)
+SWEPT_PATH_RETRIES = 3              # Checks before giving up on a blocked path
+SWEPT_PATH_RETRY_DELAY = 1.0        # seconds
+
+# Camera pre-warm
+CAMERA_PREWARM_LEAD = 2.0           # Enable the next phase cameras this many
+                                    # seconds before it starts (estimated)
+CAMERA_PREWARM_NAV_SPEED = 0.3      # Navigation speed used for that estimate
+
+# Pick service
+SERVICE_POLL_INTERVAL = 0.5         # Spool directory polling period (s)
+SERVICE_LATENCY_WINDOW = 256        # Last orders kept for the report
+
+# Localization reuse
+LOCALIZATION_PATH = '~/.hive_selection/localization.json'
+LOCALIZATION_MAX_AGE = 12 * 3600.0  # Cached localization trusted (seconds)
+LOCALIZATION_MIN_CONFIDENCE = 0.5   # When the status reports a confidence
+
+# FSM checkpoints and resume
+CHECKPOINT_PATH = '~/.hive_selection/checkpoint.json'
+CHECKPOINT_MAX_AGE = 900.0          # Older checkpoints aren't resumed (s)
+CHECKPOINT_VARIABLES = ['target_x', 'target_y', 'target_z', 'target',
+                        'num_detections', 'closest_tag_x', 'arm_targets',
+                        'arm_name', 'approach_angle_error',
+                        'sideways_distance', 'navigation_counter',
+                        'approach_counter', 'position_attempts',
+                        'pickup_attempts', 'board_cells', 'target_cell']
+MAX_RESUMES = 2                     # Resumes of the same pick, on top of
+                                    # the retry counters of each state
+RESUME_STATES = {                   # Checkpointed state -> state to resume
+    'NAVIGATING_TO_HIVE' : 'NAVIGATING_TO_HIVE',
+    'APPROACHING_HIVE' : 'APPROACHING_HIVE',
+    'DETECTING_TAGS_1' : 'DETECTING_TAGS_1',
+    'MOVING_SIDEWAYS' : 'MOVING_SIDEWAYS',
+    'DETECTING_TAGS_2' : 'DETECTING_TAGS_2',
+    'POSITION_ARM' : 'POSITION_ARM',
+    'PICK_ITEM' : 'POSITION_ARM',   # The grip is repeated from the start
+}
+RESUME_POSE_TOLERANCE = (0.05, 3.0) # Robot pose still valid (meters, deg)
+
+# Learned state timeouts
+HISTORY_PATH = '~/.hive_selection/state_history.jsonl'
+HISTORY_MAX_RECORDS = 2000          # Last picks kept in the history
+HISTORY_MIN_SAMPLES = 10            # Successful state visits to learn
+HISTORY_TIMEOUT_PERCENTILE = 95     # Of the successful state durations
+HISTORY_TIMEOUT_MARGIN = 1.5        # Learned timeout = percentile * margin
+HISTORY_TIMEOUT_MIN = 2.0           # seconds
+HISTORY_TIMEOUT_MAX_FACTOR = 2.0    # Learned timeout <= factor * default
+# State -> (fixed timeout in seconds, error on timeout). A fixed timeout of
+# None means the state has no limit until enough picks have been learned
+LEARNED_TIMEOUT_STATES = {
+    'NAVIGATING_TO_HIVE' : (None, ERROR_COULDNT_REACH_DESTINATION),
+    'APPROACHING_HIVE' : (None, ERROR_COULDNT_APPROACH_CART),
+    'DETECTING_TAGS_1' : (NO_TARGET_TIMEOUT, ERROR_TAG_NOT_FOUND),
+    'MOVING_SIDEWAYS' : (None, ERROR_COULDNT_APPROACH_CART),
+    'DETECTING_TAGS_2' : (NO_TARGET_TIMEOUT, ERROR_TAG_NOT_FOUND),
+    'POSITION_ARM' : (None, ERROR_COULDNT_POSITION_ARM),
+    'PICK_ITEM' : (None, ERROR_COULDNT_PICKUP_ITEM),
+}
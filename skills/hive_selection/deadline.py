@@ -0,0 +1,98 @@
+'''Overall pick deadline shared by every state of the skill'''
+
+import asyncio
+import math
+import time
+
+from skills.hive_selection.constants import (STATE_MIN_DURATIONS,
+                                             PICK_STATES_ORDER)
+
+
+class PickDeadline:
+    '''
+    Absolute deadline (time.time() seconds) for a whole pick, and the
+    timeout of the state being run, from its entry.
+
+    A deadline of None means there's no limit: every budget is infinite and
+    `timeout()` just returns the per-state default. The controller calls
+    run through `run()` are bounded by whichever comes first.
+    '''
+
+    def __init__(self, deadline = None):
+        self.deadline = deadline
+        self.state_deadline = None
+
+
+    @property
+    def enabled(self):
+        return self.deadline is not None
+
+
+    def start_state(self, timeout = None):
+        '''Start the `timeout` (seconds, None for no limit) of a new state'''
+        self.state_deadline = None if timeout is None else \
+                                time.time() + timeout
+
+
+    def state_expired(self):
+        return self.state_deadline is not None and \
+                time.time() >= self.state_deadline
+
+
+    def budget(self):
+        '''Seconds left until the deadline or the end of the state timeout'''
+        if self.state_deadline is None:
+            return self.remaining()
+        return min(self.remaining(), self.state_deadline - time.time())
+
+
+    def remaining(self):
+        '''Seconds left until the deadline'''
+        if not self.enabled:
+            return math.inf
+        return self.deadline - time.time()
+
+
+    def expired(self):
+        return self.remaining() <= 0.0
+
+
+    def timeout(self, default):
+        '''Per-state timeout clipped to the remaining budget'''
+        return max(0.0, min(default, self.remaining()))
+
+
+    def min_time_to_finish(self, state):
+        '''Least time needed to go from `state` to the end of the pick'''
+        if state not in PICK_STATES_ORDER:
+            return 0.0
+        index = PICK_STATES_ORDER.index(state)
+        return sum(STATE_MIN_DURATIONS.get(s, 0.0)
+                   for s in PICK_STATES_ORDER[index:])
+
+
+    def can_finish(self, state):
+        '''Whether the pick can still finish if it continues from `state`'''
+        return self.remaining() >= self.min_time_to_finish(state)
+
+
+    async def run(self, coro, on_timeout = None):
+        '''
+        INPUTS:
+            coro - controller call to await within the remaining budget
+            on_timeout - optional coroutine function called if it runs over
+
+        OUTPUTS:
+            The result of `coro`. Raises asyncio.TimeoutError if the deadline
+            or the state timeout is reached first.
+        '''
+        budget = self.budget()
+        if budget == math.inf:
+            return await coro
+
+        try:
+            return await asyncio.wait_for(coro, timeout = max(0.0, budget))
+        except asyncio.TimeoutError:
+            if on_timeout is not None:
+                await on_timeout()
+            raise
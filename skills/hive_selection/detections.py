@@ -0,0 +1,130 @@
+'''Columnar (NumPy structured array) representation of tag detections'''
+
+import time
+
+import numpy as np
+
+from skills.hive_selection.constants import DETECTION_CHANGE_THRESHOLD
+
+
+DETECTION_DTYPE = np.dtype([
+    ('tag_id', np.int32),
+    ('center_px', np.float32, (2,)),      # Pixel centre in the image
+    ('xyz', np.float64, (3,)),            # Position from base_link (meters)
+    ('orientation', np.float64, (4,)),    # Quaternion x, y, z, w
+    ('quality', np.float32),              # Decision margin of the detector
+    ('timestamp', np.float64),
+])
+
+
+def detections_to_array(predictions, timestamp = None):
+    '''
+    INPUTS:
+        predictions - list of tag prediction dicts from the apriltags model
+        timestamp - time of the frame (defaults to now)
+
+    OUTPUTS:
+        Structured array with one DETECTION_DTYPE row per prediction
+    '''
+    predictions = predictions or []
+    array = np.zeros(len(predictions), dtype = DETECTION_DTYPE)
+    if not len(predictions):
+        return array
+
+    array['timestamp'] = time.time() if timestamp is None else timestamp
+    for i, pred in enumerate(predictions):
+        pose = pred['pose_base_link'].pose
+        array[i]['tag_id'] = pred['tag_id']
+        array[i]['center_px'] = pred.get('object_center_px', (np.nan, np.nan))
+        array[i]['xyz'] = (pose.position.x, pose.position.y, pose.position.z)
+        array[i]['orientation'] = (pose.orientation.x, pose.orientation.y,
+                                   pose.orientation.z, pose.orientation.w)
+        array[i]['quality'] = pred.get('decision_margin', np.nan)
+    return array
+
+
+
+def select_tag(detections, tag_id):
+    '''Rows of the detections of `tag_id`'''
+    return detections[detections['tag_id'] == tag_id]
+
+
+
+def sort_targets(detections):
+    '''
+    Sort detections by their y position (ascending, rounded to 10 cm) and
+    ties by their x position (descending)
+    '''
+    xyz = detections['xyz']
+    order = np.lexsort((-xyz[:, 0], np.round(xyz[:, 1], 1)))
+    return detections[order]
+
+
+
+class DetectionSubscription:
+    '''
+    Decides which camera frames the detections callback actually processes:
+    none while paused, one every `decimation` frames, and with `on_change`
+    only those whose tag set changed or whose tags moved more than
+    `threshold` meters since the last delivered frame.
+    '''
+
+    def __init__(self, decimation = 1, on_change = False,
+                 threshold = DETECTION_CHANGE_THRESHOLD):
+        self.decimation = max(1, int(decimation))
+        self.on_change = on_change
+        self.threshold = threshold
+        self.paused = False
+        self.frames_received = 0
+        self.frames_delivered = 0
+        self.reset()
+
+
+    def reset(self):
+        '''Forget the last delivered frame, so the next one is delivered'''
+        self._last_ids = None
+        self._last_xyz = None
+        self._frame_count = 0
+
+
+    def frame_wanted(self):
+        '''Cheap check run before converting the frame detections'''
+        self.frames_received += 1
+        if self.paused:
+            return False
+        self._frame_count += 1
+        return (self._frame_count - 1) % self.decimation == 0
+
+
+    def changed(self, detections):
+        '''Whether the converted frame has to be delivered'''
+        if not self.on_change or self._last_ids is None or \
+                not self._same_tags(detections):
+            return self._deliver(detections)
+
+        delta = np.abs(detections['xyz'][_tag_order(detections)] -
+                       self._last_xyz)
+        if delta.size and np.max(delta) > self.threshold:
+            return self._deliver(detections)
+        return False
+
+
+    def _same_tags(self, detections):
+        ids = np.sort(detections['tag_id'])
+        return ids.shape == self._last_ids.shape and \
+               bool(np.all(ids == self._last_ids))
+
+
+    def _deliver(self, detections):
+        order = _tag_order(detections)
+        self._last_ids = detections['tag_id'][order]
+        self._last_xyz = detections['xyz'][order]
+        self.frames_delivered += 1
+        return True
+
+
+
+def _tag_order(detections):
+    '''Order of the detections by tag id, then by position'''
+    xyz = detections['xyz']
+    return np.lexsort((xyz[:, 1], xyz[:, 0], detections['tag_id']))
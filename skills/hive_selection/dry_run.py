@@ -0,0 +1,63 @@
+'''Timed plan of a pick, predicted without moving the robot'''
+
+import numpy as np
+
+from skills.hive_selection.constants import (DRY_RUN_BASE_SPEED,
+                                             DRY_RUN_ANGULAR_SPEED,
+                                             ESTIMATED_STATE_DURATIONS)
+
+
+def linear_duration(distance, speed = DRY_RUN_BASE_SPEED):
+    '''Seconds to drive `distance` meters'''
+    return abs(distance) / speed
+
+
+
+def rotation_duration(angle, speed = DRY_RUN_ANGULAR_SPEED):
+    '''Seconds to rotate `angle` degrees'''
+    return abs(angle) / speed
+
+
+
+def navigation_distance(position, goal):
+    '''Straight line distance (meters) from `position` to the `goal` dict'''
+    return float(np.hypot(position[0] - goal['x'], position[1] - goal['y']))
+
+
+
+class DryRunPlan:
+    '''Steps of a pick with their estimated durations and feasibility'''
+
+    def __init__(self):
+        self.steps = []
+        self.reasons = []
+
+
+    def add(self, state, extra_duration = 0.0, duration = None, **details):
+        '''
+        Add `state`, taking its fixed duration plus `extra_duration` seconds
+        unless a `duration` is given
+        '''
+        if duration is None:
+            duration = ESTIMATED_STATE_DURATIONS.get(state, 0.0) + \
+                            extra_duration
+        self.steps.append({'state' : state,
+                           'duration' : round(duration, 2),
+                           'details' : details})
+
+
+    def infeasible(self, reason):
+        self.reasons.append(reason)
+
+
+    @property
+    def feasible(self):
+        return not self.reasons
+
+
+    def as_dict(self):
+        return {'feasible' : self.feasible,
+                'reasons' : self.reasons,
+                'estimated_duration' : round(sum(step['duration']
+                                                 for step in self.steps), 2),
+                'states' : self.steps}
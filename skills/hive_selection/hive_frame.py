@@ -0,0 +1,150 @@
+'''Rigid hive board pose fitted to the visible tags of the hive'''
+
+from collections import Counter
+
+import numpy as np
+
+from skills.hive_selection.constants import (CELL_SIZE_X,
+                                             CELL_SIZE_Y,
+                                             HIVE_FIT_MIN_TAGS,
+                                             HIVE_FIT_ITERATIONS)
+
+
+class HiveFrame:
+    '''
+    Pose of the hive board in the base_link frame.
+
+    The board frame has its origin in the tag of cell (0, 0), the X axis
+    along the rows (depth) and the Y axis along the columns, so the tag of
+    cell (row, col) is at (row * CELL_SIZE_X, col * CELL_SIZE_Y, 0).
+
+    The fit counts the cells from the closest, right-most visible tag. Once
+    anchored (anchor() or align()), the cells are counted from a fixed cell
+    of the hive instead, `offset` being the cell of the board origin.
+    '''
+
+    def __init__(self, rotation, translation, residual, n_tags):
+        self.rotation = rotation
+        self.translation = translation
+        self.residual = residual        # RMS fit error (meters)
+        self.n_tags = n_tags
+        self.offset = np.zeros(2, dtype = int)  # Cell of the board origin
+
+
+    def cell_position(self, row, col):
+        '''base_link position of the tag of cell (row, col)'''
+        return self.rotation @ board_layout([[row, col]] - self.offset)[0] + \
+                    self.translation
+
+
+    def cell_positions(self, n_rows, n_cols):
+        '''(n_rows, n_cols, 3) array with the position of every cell'''
+        rows, cols = np.meshgrid(np.arange(n_rows), np.arange(n_cols),
+                                 indexing = 'ij')
+        cells = np.stack([rows.ravel(), cols.ravel()], axis = 1)
+        positions = board_layout(cells - self.offset) @ self.rotation.T + self.translation
+        return positions.reshape(n_rows, n_cols, 3)
+
+
+    def cell_of(self, points):
+        '''(row, col) indices of the cells closest to base_link `points`'''
+        board = (np.asarray(points, dtype = float) - self.translation) \
+                    @ self.rotation
+        return np.rint(board[:, :2] / [CELL_SIZE_X, CELL_SIZE_Y]).astype(int) \
+                    + self.offset
+
+
+    def anchor(self, origin):
+        '''
+        Count the cells from the cell whose tag is at base_link `origin`. Only
+        valid from the pose where `origin` was measured (docked to the hive).
+        '''
+        board = (self.translation - np.asarray(origin, dtype = float)) \
+                    @ self.rotation
+        self.offset = np.rint(
+                board[:2] / [CELL_SIZE_X, CELL_SIZE_Y]).astype(int)
+
+
+    def align(self, cells, points):
+        '''
+        Count the cells as the known [row, col] `cells` of the hive (seen from
+        another pose), shifting the cells of the base_link tag `points` so
+        they overlap as many of them as possible. False if no shift or more
+        than one shift gives the best overlap.
+        '''
+        seen = self.cell_of(points) - self.offset
+        shifts = Counter((row - seen_row, col - seen_col)
+                         for row, col in cells for seen_row, seen_col in seen)
+        best = shifts.most_common(2)
+        if not best or (len(best) > 1 and best[0][1] == best[1][1]):
+            return False
+        self.offset = np.array(best[0][0], dtype = int)
+        return True
+
+
+
+def board_layout(cells):
+    '''Board frame positions of the tags of (row, col) `cells`'''
+    cells = np.asarray(cells, dtype = float)
+    layout = np.zeros((len(cells), 3))
+    layout[:, 0] = cells[:, 0] * CELL_SIZE_X
+    layout[:, 1] = cells[:, 1] * CELL_SIZE_Y
+    return layout
+
+
+
+def rigid_fit(source, target):
+    '''
+    Least-squares rigid transform (Kabsch) so that R @ source + t ~ target.
+    Returns a None rotation when the source points are collinear, since the
+    rotation about that line is then undetermined.
+    '''
+    source_mean = source.mean(axis = 0)
+    target_mean = target.mean(axis = 0)
+    source_c = source - source_mean
+    target_c = target - target_mean
+
+    if len(source) < 3 or np.linalg.matrix_rank(source_c, tol = 1e-6) < 2:
+        return None, target_mean - source_mean
+
+    u, _, vt = np.linalg.svd(source_c.T @ target_c)
+    d = np.sign(np.linalg.det(vt.T @ u.T))
+    rotation = vt.T @ np.diag([1.0, 1.0, d]) @ u.T
+    return rotation, target_mean - rotation @ source_mean
+
+
+
+def fit_hive_frame(points):
+    '''
+    INPUTS:
+        points - (N, 3) base_link positions of the visible tags of the hive
+
+    OUTPUTS:
+        HiveFrame fitted to all the tags in a single least-squares solve, or
+        None if there are less than HIVE_FIT_MIN_TAGS tags. Tags are assigned to cells by snapping
+        them to the grid, starting with the board aligned to the robot.
+    '''
+    points = np.asarray(points, dtype = float).reshape(-1, 3)
+    if len(points) < HIVE_FIT_MIN_TAGS:
+        return None
+
+    # Initial guess: board aligned with base_link, cell (0, 0) being the
+    # closest (min x), right-most (min y) tag
+    translation = np.array([points[:, 0].min(), points[:, 1].min(),
+                            points[:, 2].mean()])
+    frame = HiveFrame(np.eye(3), translation, np.inf, len(points))
+
+    for _ in range(HIVE_FIT_ITERATIONS):
+        cells = frame.cell_of(points)
+        cells -= cells.min(axis = 0)
+        layout = board_layout(cells)
+        rotation, translation = rigid_fit(layout, points)
+        if rotation is None:
+            # Translation only fit, keep the orientation of the guess
+            rotation = frame.rotation
+            translation = (points - layout @ rotation.T).mean(axis = 0)
+        residual = np.sqrt(np.mean(np.sum(
+                (layout @ rotation.T + translation - points)**2, axis = 1)))
+        frame = HiveFrame(rotation, translation, residual, len(points))
+
+    return frame
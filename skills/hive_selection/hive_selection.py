@@ -16,10 +16,39 @@ from raya.tools.image import show_image, draw_on_image
 from skills.hive_selection.constants import *
 from skills.hive_selection.arms import *
 from skills.hive_selection.navigation import *
+from skills.hive_selection.metrics import PickMetrics, MetricsExporter
+from skills.hive_selection.deadline import PickDeadline
+from skills.hive_selection.motion_coordinator import (MotionCoordinator,
+                                                      BaseMotionTracker)
+from skills.hive_selection.arm_state import ArmStateTracker
+from skills.hive_selection.arm_selection import nearest_arm, pair_targets
+from skills.hive_selection.arm_profiles import (motion_profile,
+                                                choose_motion_profile,
+                                                hive_clearance, pre_grasp_pose)
+from skills.hive_selection.inventory import HiveInventory, visible_cells
+from skills.hive_selection.hive_frame import fit_hive_frame
+from skills.hive_selection.detections import (detections_to_array, select_tag,
+                                              sort_targets,
+                                              DetectionSubscription)
+from skills.hive_selection.visualization import DetectionVisualizer
+from skills.hive_selection.resources import ResourceManager
+from skills.hive_selection.cameras import CameraManager
+from skills.hive_selection.localization import (LocalizationCache,
+                                                localization_reusable)
+from skills.hive_selection.checkpoint import CheckpointStore, resume_state
+from skills.hive_selection.state_history import StateHistory
+from skills.hive_selection.lidar import (LidarScan, fit_face_ransac,
+                                         swept_path_check)
+from skills.hive_selection.base_speed import linear_speed, angular_speed
+from skills.hive_selection.dry_run import (DryRunPlan, linear_duration,
+                                           rotation_duration,
+                                           navigation_distance)
 
 # Other imports
 import asyncio
 import argparse
+import inspect
+import copy
 import time
 import cv2
 import numpy as np
@@ -38,8 +67,26 @@ class SkillHiveSelection(RayaFSMSkill):
     
     DEFAULT_SETUP_ARGS = {
         'fsm_log_transitions': True,
-        'arm_name' : 'right_arm',
-        'tag_families' : ['tag36h11.43','tag36h11.1']
+        'arm_name' : 'right_arm',   # Or 'auto' for the nearest to the target
+        'dual_arm' : False,         # Pick two neighbouring cells at once
+        'provisional_arm_profiles' : False, # Trust the uncalibrated arm
+                                    # profiles for 'auto' and 'dual_arm'
+        'tag_families' : ['tag36h11.43','tag36h11.1'],
+        'metrics_port' : None,      # Local HTTP port for Prometheus scraping
+        'metrics_file' : None,      # Prometheus text file, written per pick
+        'concurrent_motion' : True, # Overlap arm and base moves when safe
+        'hive_name' : None,         # Hive identifier (defaults to item_name)
+        'inventory_path' : INVENTORY_PATH,
+        'debug_visualization' : False, # Show the detections in a window
+        'visualization_dir' : None, # Directory to save the detection frames
+        'detections_decimation' : 1, # Process one every N camera frames
+        'detections_on_change' : False, # Only process frames that changed
+        'lidar_docking' : True,     # Shorten the tag approach with the lidar
+        'localization_path' : LOCALIZATION_PATH,
+        'force_localization' : False, # Set the map even if localized on it
+        'checkpoint_path' : CHECKPOINT_PATH,
+        'history_path' : HISTORY_PATH,
+        'learned_timeouts' : True,  # Timeouts from the successful picks
     }
 
     REQUIRED_EXECUTE_ARGS = [
@@ -49,7 +96,13 @@ class SkillHiveSelection(RayaFSMSkill):
 
     DEFAULT_EXECUTE_ARGS = {
         'identifier': [2],
-        'distance_to_goal' : 0.70
+        'distance_to_goal' : 0.70,
+        'pick_deadline' : None,     # Absolute time (time.time()) to finish by
+        'dry_run' : False,          # Only return the predicted plan, no motion
+        'item_name' : None,         # Item of this pick (defaults to setup's)
+        'resume' : False,           # Resume the last checkpoint of this pick
+        'keep_resources' : False,   # Keep the cameras and models enabled
+                                    # after the pick (until finish)
     }
 
 
@@ -74,8 +127,9 @@ class SkillHiveSelection(RayaFSMSkill):
         'END'
     ]
     
-    STATES_TIMEOUTS = {'DETECTING_TAGS_1' :
-                       (NO_TARGET_TIMEOUT, ERROR_TAG_NOT_FOUND)}
+    # The skill times its states itself (PickDeadline), with the fixed or
+    # learned timeouts of LEARNED_TIMEOUT_STATES
+    STATES_TIMEOUTS = {}
 
     debug = True
     if debug is True:
@@ -86,9 +140,43 @@ class SkillHiveSelection(RayaFSMSkill):
 
     async def setup(self):
         
+        # Metrics
+        self.metrics = PickMetrics()
+        self.metrics_exporter = MetricsExporter(
+            self.metrics,
+            port = self.setup_args['metrics_port'],
+            textfile = self.setup_args['metrics_file'],
+            log = self.log
+        )
+        self.metrics_exporter.start()
+
         # Setup variables
         self.setup_variables()
 
+        # Debug visualisation of the detections
+        self.visualizer = None
+        if self.setup_args['debug_visualization'] or \
+                self.setup_args['visualization_dir']:
+            self.visualizer = DetectionVisualizer(
+                self.log,
+                output_dir = self.setup_args['visualization_dir'],
+                display = self.setup_args['debug_visualization']
+            )
+            self.visualizer.start()
+
+        # FSM checkpoints
+        self.checkpoints = CheckpointStore(self.setup_args['checkpoint_path'])
+        self.checkpoint_task = None
+        self.checkpoint_pose = None     # Pose read at the last transition
+
+        # Durations of the past picks
+        self.history = StateHistory(self.setup_args['history_path'])
+
+        # Arm/base motion coordinator
+        self.motion_coordinator = MotionCoordinator(
+            self.log, enabled = self.setup_args['concurrent_motion'])
+        self.base_motion = BaseMotionTracker(self.log)
+
         # Get controllers
         self.cameras = await self.get_controller('cameras')
         self.log.info('Cameras controller - Enabled')
@@ -99,25 +187,18 @@ class SkillHiveSelection(RayaFSMSkill):
         self.motion = await self.get_controller('motion')
         self.log.info('Motion controller - Enabled')
         self.lidar = await self.get_controller('lidar')
+        self.lidar_info = self.lidar.get_laser_info(ang_unit = ANGLE_UNIT.RADIANS)
         self.log.info('Lidar controller - Enabled')
         self.arms = await self.get_controller('arms')
         self.log.info('Arms controller - Enabled')
         self.sound = await self.get_controller('sound')
         self.log.info('Sound controller - Enabled')
 
-        # Enable cameras
-        self.log.info(f"Enabling camera {self.setup_args['working_camera_1']}...")
-        await self.cameras.enable_color_camera(self.setup_args['working_camera_1'])
-        self.log.info(f"Enabling camera {self.setup_args['working_camera_2']}...")
-        await self.cameras.enable_color_camera(self.setup_args['working_camera_2'])
-        
-        # Set map
-        self.log.info(f"Localizing in map: {self.setup_args['map_name']}...")
-        await self.navigation.set_map(
-            map_name = self.setup_args['map_name'],
-            wait_localization = True,
-            wait = True
-        )
+        # Cameras and models, enabled on demand by each state
+        self.register_resources()
+
+        # Set map, unless already localized on it
+        await self.localize()
 
         # Resgister approach skill
         self.log.info('Registering Helper Skill: ApproachToTags...')
@@ -128,7 +209,74 @@ class SkillHiveSelection(RayaFSMSkill):
 
 
     async def finish(self):
-        pass
+        await self.resources.release_all()
+        self.log.info(f'Resources: {self.resources.report()}')
+        self.metrics_exporter.stop()
+        if self.visualizer is not None:
+            self.visualizer.stop()
+
+
+    async def main(self):
+        '''Run one pick through the FSM, keeping the pick metrics'''
+        self.select_item(self.execute_args['item_name'] or
+                         self.setup_args['item_name'])
+        self.reset_pick_variables()
+        self.learn_state_timeouts()
+        self.deadline = PickDeadline(self.execute_args['pick_deadline'])
+        if self.execute_args['dry_run']:
+            plan = await self.dry_run()
+            await self.send_feedback(plan)
+            return plan
+
+        self.metrics.inc('picks_attempted_total')
+        try:
+            if self.execute_args['resume']:
+                await self.resume_pick()
+            if not self.deadline.can_finish(self.current_state):
+                self.abort(*ERROR_PICK_DEADLINE_EXCEEDED)
+            self.deadline.start_state(
+                    self.state_timeouts.get(self.current_state))
+            self.save_checkpoint(self.current_state)
+            result = await super().main()
+            if self.current_state in self.END_STATES:
+                self.metrics.inc('picks_succeeded_total')
+            return result
+
+        finally:
+            # Back to the class initial state
+            self.__dict__.pop('INITIAL_STATE', None)
+            if self.checkpoint_task is not None:
+                await asyncio.gather(self.checkpoint_task,
+                                     return_exceptions = True)
+            await self.base_motion.wait_idle()
+            self.base_motion.reset()
+            if not self.execute_args['keep_resources']:
+                await self.resources.unpin()
+            await self.resources.sync_phase([])
+            self.record_pick_metrics()
+            self.record_pick_history()
+
+
+    def set_state(self, state):
+        '''Set the next FSM state, timing the one being left'''
+        now = time.time()
+        self.record_state_duration(now - self.state_start_time)
+        self.current_state = state
+        self.state_start_time = now
+        self.detection_subscription.paused = state not in VISION_STATES
+        if not self.deadline.can_finish(state):
+            self.log.warn(f'{self.deadline.remaining():.1f}s left, not enough '
+                          f'to finish the pick from {state}')
+            self.abort(*ERROR_PICK_DEADLINE_EXCEEDED)
+        self.deadline.start_state(self.state_timeouts.get(state))
+        self.save_checkpoint(state)
+        super().set_state(state)
+
+
+    def abort(self, error_code, error_msg):
+        '''Abort the skill, counting the abort reason'''
+        self.metrics.inc('aborts_total', code = error_code, reason = error_msg)
+        super().abort(error_code, error_msg)
 
 
     ###------------------------------ HELPERS ------------------------------###
@@ -137,16 +285,61 @@ class SkillHiveSelection(RayaFSMSkill):
         '''Setup initial variables'''
 
         # General variables
-        self.convertion_dict = {'bottle' : 4, # Dict to convert item name
-                                'towel' : 1,        # to apriltag number
-                                'pajamas' : 3}
-        self.tag_id = self.convertion_dict[self.setup_args['item_name']] # Tag number
+        self.convertion_dict = ITEM_TAG_IDS  # Item name to apriltag number
+        self.select_item(self.setup_args['item_name'])
+        self.tags_info = self.create_dict_arg(self.setup_args['tag_families'])
+        self.detection_subscription = DetectionSubscription(
+                decimation = self.setup_args['detections_decimation'],
+                on_change = self.setup_args['detections_on_change'])
+        self.inventory = HiveInventory(self.setup_args['inventory_path'])
+
+        # Arms variables
+        self.arm_selection = self.setup_args['arm_name']
+        if self.arm_selection != 'auto' and \
+                self.arm_selection not in ARM_PROFILES:
+            raise ValueError(f'Unknown arm_name: {self.arm_selection}')
+        self.arm_name = 'right_arm' if self.arm_selection == 'auto' \
+                            else self.arm_selection # Arm of the first target
+        self.dual_arm = self.setup_args['dual_arm']
+        self.selectable_arms = list(ARM_PROFILES)  # Arms 'auto' picks from
+        if not self.setup_args['provisional_arm_profiles']:
+            # The selection relies on the shoulder and reach of every arm,
+            # keep to the calibrated ones
+            self.selectable_arms = [arm for arm, profile in
+                                    ARM_PROFILES.items()
+                                    if profile['calibrated']]
+            if self.dual_arm:
+                self.log.warn('dual_arm needs provisional_arm_profiles, '
+                              'picking with one arm')
+                self.dual_arm = False
+            if self.arm_selection not in ['auto'] + self.selectable_arms:
+                self.log.warn(f'{self.arm_selection} profile not calibrated')
+        self.arm_trackers = {arm : ArmStateTracker() # Last commanded move
+                             for arm in ARM_PROFILES}
+
+        self.reset_pick_variables()
+
+
+
+    def select_item(self, item_name):
+        '''Set the item to pick, its tag and the hive holding it'''
+        if item_name not in self.convertion_dict:
+            self.abort(*ERROR_UNKNOWN_ITEM)
+        self.item_name = item_name
+        self.tag_id = self.convertion_dict[item_name] # Tag number
+        self.hive_name = self.setup_args['hive_name'] or item_name
+
+
+
+    def reset_pick_variables(self):
+        '''Reset the variables that only live for one pick'''
         self.navigation_successful = False  # Navigation success flag
         self.approach_successful = False    # Approach success flag
         self.target_x = None                # x of the tag (from baselink)
         self.target_y = None                # y of the tag (from baselink)
         self.target_z = None                # z of the tag (from baselink)
         self.navigation_counter = 0         # Navigation attempts counter
+        self.resumes = 0                    # Times this pick was resumed
         self.position_attempts = 0          # Arm position attempts counter
         self.pickup_attempts = 0            # Item pickup attempts counter
         self.approach_final_linear = 0      # Approach final linear step
@@ -154,16 +347,444 @@ class SkillHiveSelection(RayaFSMSkill):
         self.approach_counter = 0           # Counter for the approach attempts
         self.sideways_distance = 0          # Sideways distance to move
         self.detections_dict = {}           # Dictionary to store detections
+        self.detections_array = detections_to_array([]) # Last frame detections
         self.tags_detected = False          # Flag whether tags are detected
         self.num_detections = 0             # Number of detections in hive
-        self.dynamic_trex = [0, 0, 0]       # Position after dynamic trex func
+        self.dynamic_trex = {}              # Arm -> position after dynamic trex
+        self.arm_targets = {}               # Arm -> target it picks
         self.closest_tag_x = 0              # Closest tag (on X axis)
-        self.tags_info = self.create_dict_arg(self.setup_args['tag_families'])
+        self.target = None                  # Target chosen in the hive
+        self.predicted_target = None        # Inventory record of the hive
+        self.sideways_motion = None         # Handle of the sideways motion
+        self.back_off = None                # Handle of the last back off
+        self.hive_frame = None              # Board pose fitted to the tags
+        self.board_cells = None             # Hive cells seen while docked
+        self.target_cell = None             # Hive cell of the target
+        self.current_state = self.INITIAL_STATE # State being executed
+        self.state_start_time = time.time() # Time the state was entered
+        self.deadline = PickDeadline()      # Overall pick deadline
+        self.state_durations = {}           # State -> seconds of each visit
+        self.state_timeouts = {state : timeout for state, (timeout, _)
+                               in LEARNED_TIMEOUT_STATES.items()}
+        self.detection_subscription.paused = \
+                                    self.current_state not in VISION_STATES
+
+
+
+    async def localize(self):
+        '''Set the map and wait for the localization, if it's needed'''
+        map_name = self.setup_args['map_name']
+        cache = LocalizationCache(self.setup_args['localization_path'])
+        if not self.setup_args['force_localization'] and \
+                await self.localized_on(map_name, cache.get(map_name)):
+            self.log.info(f'Already localized in map: {map_name}')
+            self.metrics.inc('localizations_reused_total')
+            return
 
+        self.log.info(f'Localizing in map: {map_name}...')
+        await self.navigation.set_map(
+            map_name = map_name,
+            wait_localization = True,
+            wait = True
+        )
+        self.metrics.inc('localizations_total')
+        try:
+            position = await self.navigation.get_position(
+                                                pos_unit = POSITION_UNIT.METERS,
+                                                ang_unit = ANGLE_UNIT.DEGREES)
+        except Exception as e:
+            self.log.warn(f'Couldnt read the position - {e}')
+            position = None
+        cache.save(map_name, position)
+
+
+
+    async def localized_on(self, map_name, record):
+        '''Whether the navigation status says the robot is on `map_name`'''
+        try:
+            status = self.navigation.get_status()
+            if inspect.isawaitable(status):
+                status = await status
+        except Exception as e:
+            self.log.warn(f'Couldnt read the navigation status - {e}')
+            return False
+        return localization_reusable(status, map_name, record)
+
+
+
+    def save_checkpoint(self, state):
+        '''
+        Checkpoint the pick entering `state`: the state and the variables
+        now, and the robot pose read right away. The base doesn't move
+        before that read completes (wait_checkpoint_pose), so the pose is
+        the one at the transition. Writes are chained so they land in
+        order. Reaching an end state clears the checkpoint.
+        '''
+        if state == 'IDLE':
+            state = self.next_state
+        if state in self.END_STATES:
+            checkpoint = None
+        elif state in RESUME_STATES:
+            checkpoint = {
+                'state' : state,
+                'time' : time.time(),
+                'map_name' : self.setup_args['map_name'],
+                'hive_name' : self.hive_name,
+                'item_name' : self.item_name,
+                'resumes' : self.resumes,
+                'variables' : copy.deepcopy(
+                    {name : getattr(self, name)
+                     for name in CHECKPOINT_VARIABLES}),
+            }
+        else:
+            return
+        pose = None
+        if checkpoint is not None:
+            pose = self.checkpoint_pose = asyncio.ensure_future(
+                    self.navigation.get_position(
+                                                pos_unit = POSITION_UNIT.METERS,
+                                                ang_unit = ANGLE_UNIT.DEGREES))
+        self.checkpoint_task = asyncio.ensure_future(
+                self.write_checkpoint(checkpoint, pose, self.checkpoint_task))
+
+
+
+    async def wait_checkpoint_pose(self):
+        '''Wait for the pose of the last checkpoint to be read'''
+        if self.checkpoint_pose is not None:
+            await asyncio.gather(self.checkpoint_pose, return_exceptions = True)
+
+
+
+    async def write_checkpoint(self, checkpoint, pose, previous = None):
+        '''
+        INPUTS:
+            checkpoint - dict to write, None to clear the checkpoint
+            pose - task reading the robot pose at the transition
+            previous - write task of the previous checkpoint
+        '''
+        if previous is not None:
+            await asyncio.gather(previous, return_exceptions = True)
+        try:
+            if checkpoint is None:
+                self.checkpoints.clear()
+                return
+            try:
+                checkpoint['pose'] = await pose
+            except Exception as e:
+                self.log.warn(f'Couldnt read the pose to checkpoint - {e}')
+                checkpoint['pose'] = None
+            self.checkpoints.save(checkpoint)
+        except OSError as e:
+            self.log.warn(f'Couldnt write the checkpoint - {e}')
+
+
+
+    async def resume_pick(self):
+        '''
+        Restore the last checkpoint of this pick and start the FSM from the
+        deepest state that is still valid for the current robot pose
+        '''
+        checkpoint = self.checkpoints.load(self.setup_args['map_name'],
+                                           self.hive_name, self.item_name)
+        if checkpoint is None:
+            self.log.info('No checkpoint to resume, starting the pick')
+            return
+
+        # Bound crash loops, the retry counters only bound each state
+        self.resumes = checkpoint.get('resumes', 0) + 1
+        if self.resumes > MAX_RESUMES:
+            self.log.warn(f'Pick already resumed {MAX_RESUMES} times, '
+                          f'dropping its checkpoint')
+            self.checkpoints.clear()
+            self.abort(*ERROR_TOO_MANY_RESUMES)
+
+        pose = await self.navigation.get_position(
+                                                pos_unit = POSITION_UNIT.METERS,
+                                                ang_unit = ANGLE_UNIT.DEGREES)
+        state = resume_state(checkpoint, pose)
+        for name in CHECKPOINT_VARIABLES:
+            if name in checkpoint['variables']:
+                setattr(self, name, checkpoint['variables'][name])
+        for tracker in self.arm_trackers.values():
+            tracker.invalidate()
+
+        # The arms may have stopped in the cell with the gripper closed,
+        # release the item before positioning them again, and take them out
+        # before the base moves
+        arm_states = PICK_STATES_ORDER[PICK_STATES_ORDER.index('POSITION_ARM'):]
+        if checkpoint['state'] in arm_states:
+            await self.gripper_command('open', self.gripper_arm())
+            if state not in arm_states:
+                await self.return_arms_home()
+
+        self.log.info(f'Resuming the pick from {state} '
+                      f'(checkpoint in {checkpoint["state"]})')
+        self.metrics.inc('resumes_total', state = state)
+        await self.send_feedback({'resuming from' : state})
+        self.next_state = state
+        self.INITIAL_STATE = 'IDLE'
+        self.current_state = 'IDLE'
+        self.detection_subscription.paused = True
+
+
+
+    def register_resources(self):
+        '''Register the cameras and the tags detector as shared resources'''
+        self.resources = ResourceManager(self.log, sleep = self.sleep)
+        self.camera_manager = CameraManager(self.cameras, self.log)
+
+        cameras = {'camera_1' : self.setup_args['working_camera_1'],
+                   'camera_2' : self.setup_args['working_camera_2']}
+        for name, camera in cameras.items():
+            self.resources.register(
+                name,
+                acquire = lambda camera = camera:
+                            self.camera_manager.enable(camera),
+                release = lambda camera = camera:
+                            self.camera_manager.disable(camera))
+
+        self.resources.register('tags_detector',
+                                acquire = self.enable_tags_detector,
+                                release = self.disable_tags_detector)
+
+
+
+    async def sync_phase_resources(self, expected_duration = None):
+        '''
+        INPUTS:
+            expected_duration - estimated seconds the current state lasts
+                                (defaults to ESTIMATED_STATE_DURATIONS)
+
+        OUTPUTS:
+            Acquires what the current state needs, releases the rest and
+            pre-warms what the next state needs shortly before it starts
+        '''
+        await self.resources.sync_phase(
+                PHASE_RESOURCES.get(self.current_state, []))
+        if self.execute_args['keep_resources']:
+            await self.resources.pin()          # Warm for the next pick
+
+        if self.current_state not in PICK_STATES_ORDER[:-1]:
+            return
+        next_state = PICK_STATES_ORDER[
+                        PICK_STATES_ORDER.index(self.current_state) + 1]
+        if expected_duration is None:
+            expected_duration = ESTIMATED_STATE_DURATIONS.get(
+                                                    self.current_state, 0.0)
+        self.resources.prewarm(
+                PHASE_RESOURCES.get(next_state, []),
+                delay = max(0.0, expected_duration - CAMERA_PREWARM_LEAD))
+
+
+
+    async def enable_tags_detector(self):
+        '''Enable the apriltags model and its listeners'''
+        # Enable model
+        self.log.info('Enabling apriltags model...')
+
+        self.predictor_handler = await self.cv.enable_model(
+                model = 'detector',type = 'tag',
+                name = 'apriltags', 
+                source = self.setup_args['working_camera_2'],
+                model_params = {
+                'families' : 'tag36h11',
+                'nthreads' : 4,
+                'quad_decimate' : 2.0,
+                'quad_sigma': 0.0,
+                'decode_sharpening' : 0.25,
+                'refine_edges' : 1,
+                'tag_size' : self.setup_args['tag_size']
+                }
+            )
+        
+        # Create listeners
+        await self.predictor_handler.find_tags(
+                tags = self.tags_info, 
+                callback = self.callback_specific_tags
+            )
+        
+        self.predictor_handler.set_img_detections_callback(
+                callback = self.callback_predictions,
+                as_dict = True,
+                call_without_detections = True,
+                cameras_controller = self.cameras
+            )
 
-        # Arms variables
-        self.arm_name = self.setup_args['arm_name']
-        self.joint_names = JOINT_NAMES
+
+
+    async def disable_tags_detector(self):
+        '''Disable the apriltags model (its listeners go with it)'''
+        await self.cv.disable_model(model_obj = self.predictor_handler)
+        self.predictor_handler = None
+
+
+
+    def record_state_duration(self, seconds):
+        '''Time one visit of the current state, from its entry'''
+        self.metrics.observe_state(self.current_state, seconds)
+        if self.current_state in PICK_STATES_ORDER:
+            self.state_durations.setdefault(self.current_state, []).append(
+                                                                    seconds)
+
+
+
+    def record_pick_history(self):
+        '''Append the outcome and state durations of the pick to the history'''
+        try:
+            self.history.append({
+                'time' : time.time(),
+                'map_name' : self.setup_args['map_name'],
+                'hive_name' : self.hive_name,
+                'item_name' : self.item_name,
+                'success' : self.current_state in self.END_STATES,
+                'final_state' : self.current_state,
+                'durations' : {state : [round(seconds, 3) for seconds in visits]
+                               for state, visits
+                               in self.state_durations.items()},
+                'attempts' : {counter : getattr(self, counter) for counter in
+                              ['navigation_counter', 'approach_counter',
+                               'position_attempts', 'pickup_attempts']},
+            })
+        except OSError as e:
+            self.log.warn(f'Couldnt write the state history - {e}')
+
+
+
+    def learn_state_timeouts(self):
+        '''
+        Timeouts of the states of this pick, learned from the visits of the
+        successful picks of hive and item. They start when the state is
+        entered (set_state) and bound its controller calls (with_deadline)
+        like the pick deadline does.
+        '''
+        if not self.setup_args['learned_timeouts']:
+            return
+        for state, (default, _) in LEARNED_TIMEOUT_STATES.items():
+            timeout = self.history.timeout(state, self.hive_name,
+                                           self.item_name, default)
+            if timeout != default:
+                fixed = 'none' if default is None else f'{default:.1f}s'
+                self.log.info(f'Learned timeout of {state}: {timeout:.1f}s '
+                              f'(default {fixed})')
+            self.state_timeouts[state] = timeout
+
+
+
+    def record_pick_metrics(self):
+        '''Close the last state timing and export the pick counters'''
+        self.record_state_duration(time.time() - self.state_start_time)
+        self.state_start_time = time.time()
+        for counter in ['navigation_counter', 'approach_counter',
+                        'position_attempts', 'pickup_attempts']:
+            self.metrics.inc('retries_total', getattr(self, counter),
+                             counter = counter)
+        self.metrics_exporter.write_textfile()
+        trackers = self.arm_trackers.values()
+        self.log.info(
+            f'Arm moves: {sum(t.moves_commanded for t in trackers)} '
+            f'commanded, {sum(t.moves_skipped for t in trackers)} skipped')
+        self.log.info(f'Pick metrics: {self.metrics.summary()}')
+
+
+
+    async def with_deadline(self, coro, on_timeout = None):
+        '''Await a controller call, aborting at the deadline or timeout'''
+        try:
+            return await self.deadline.run(coro, on_timeout = on_timeout)
+        except asyncio.TimeoutError:
+            self.deadline_exceeded()
+
+
+
+    async def arm_call(self, arm, coro):
+        '''Await an arm or gripper call, stopping `arm` at the pick deadline'''
+        return await self.with_deadline(
+                        coro, on_timeout = lambda: self.stop_arm(arm))
+
+
+
+    async def stop_arm(self, arm):
+        '''Cancel the motion of `arm` ('both' for every arm)'''
+        for name in (list(ARM_PROFILES) if arm == 'both' else [arm]):
+            try:
+                await self.arms.cancel_execution(arm = name)
+            except Exception as e:
+                self.log.warn(f'Couldnt stop {name} - {e}')
+
+
+
+    async def move_arms(self, moves, retract = True):
+        '''
+        INPUTS:
+            moves - dict arm -> coroutine moving that arm
+            retract - whether to retract the arms to T-rex if a move fails
+
+        OUTPUTS:
+            Runs the moves at once. If one fails, the other moves are
+            cancelled and their arms stopped, so no arm keeps moving while
+            the state aborts; the arms are then retracted (if `retract`) and
+            the error is raised.
+        '''
+        tasks = {arm : asyncio.ensure_future(move)
+                 for arm, move in moves.items()}
+        try:
+            await asyncio.gather(*tasks.values())
+        except Exception:
+            moving = [arm for arm, task in tasks.items() if not task.done()]
+            for arm in moving:
+                tasks[arm].cancel()
+            await asyncio.gather(*tasks.values(), return_exceptions = True)
+            await asyncio.gather(*(self.stop_arm(arm) for arm in moving))
+            if retract:
+                results = await asyncio.gather(
+                        *(self.static_trex_position(arm, profile = 'retreat')
+                          for arm in tasks),
+                        return_exceptions = True)
+                for arm, result in zip(tasks, results):
+                    if isinstance(result, Exception):
+                        self.log.error(f'Couldnt retract {arm} - {result}')
+            raise
+
+
+
+    def check_deadline(self, needed = 0.0):
+        '''Abort if less than `needed` seconds are left for the pick'''
+        if self.deadline.remaining() < needed:
+            self.deadline_exceeded()
+
+
+
+    def deadline_exceeded(self):
+        '''Abort the pick, its deadline or the state timeout was reached'''
+        if not self.deadline.expired() and self.deadline.state_expired() and \
+                self.current_state in LEARNED_TIMEOUT_STATES:
+            self.log.warn(f'Timeout of {self.current_state} reached')
+            self.abort(*LEARNED_TIMEOUT_STATES[self.current_state][1])
+        self.log.warn(f'Pick deadline reached in {self.current_state}')
+        self.abort(*ERROR_PICK_DEADLINE_EXCEEDED)
+
+
+
+    async def move_base(self, name, motion, wait = True):
+        '''
+        INPUTS:
+            name - name of the motion (for logs)
+            motion - function returning the motion controller call (with
+                     wait = True), called once the previous motion stopped
+            wait - whether to wait until the motion stops
+
+        OUTPUTS:
+            Result of the motion if `wait`, otherwise its MotionHandle. The
+            motion is bounded by the pick deadline.
+        '''
+        await self.wait_checkpoint_pose()
+        handle = await self.base_motion.start(
+                name, lambda: self.with_deadline(
+                            motion(), on_timeout = self.motion.cancel_motion))
+        if wait:
+            return await handle
+        return handle
 
 
 
@@ -184,9 +805,12 @@ class SkillHiveSelection(RayaFSMSkill):
         '''
 
         # Get the min distance read from the lidar
-        raw_lidar_data = self.lidar.get_raw_data()
-        raw_front_data = raw_lidar_data[-10:] + raw_lidar_data[:10]
-        min_scan_distance = min(raw_front_data)
+        min_scan_distance = self.get_lidar_scan().sector_min(
+                                        half_width = LIDAR_FRONT_SECTOR)
+        if not np.isfinite(min_scan_distance):
+            self.log.warn('No lidar returns in front of the robot')
+            self.approach_successful = False
+            return
         min_actual_distance = min_scan_distance - thresh
 
         # If you're close enough, return
@@ -196,10 +820,14 @@ class SkillHiveSelection(RayaFSMSkill):
 
         # Otherwise, try to move forwards  max_attempts
         else:
-            await self.motion.move_linear(distance = min_actual_distance,
-                                            x_velocity = 0.05)
-            raw_lidar_data = self.lidar.get_raw_data()
-            min_scan_distance = min(raw_lidar_data)
+            await self.move_base(
+                'approach',
+                lambda: self.motion.move_linear(
+                        distance = min_actual_distance,
+                        x_velocity = self.plan_linear_speed(min_actual_distance),
+                        wait = True))
+            min_scan_distance = self.get_lidar_scan().sector_min(
+                                        half_width = LIDAR_FRONT_SECTOR)
             min_actual_distance = min_scan_distance - thresh
 
             if min_actual_distance <= thresh:
@@ -212,16 +840,217 @@ class SkillHiveSelection(RayaFSMSkill):
         self.approach_successful = False
 
 
-    async def gripper_command(self, command):
-        """Opens/closes both grippers"""
+    def get_lidar_scan(self):
+        '''Latest lidar scan, with the cached angle index of the sensor'''
+        return LidarScan(self.lidar.get_raw_data(),
+                         angle_min = self.lidar_info['angle_min'],
+                         angle_increment = self.lidar_info['angle_increment'])
+
+
+
+    def get_front_clearance(self):
+        '''Min distance read by the lidar in front of the robot (meters)'''
+        return self.get_lidar_scan().clearance(half_width = LIDAR_FRONT_SECTOR)
+
+
+
+    def plan_linear_speed(self, distance, max_speed = BASE_LINEAR_SPEED_MAX):
+        '''
+        INPUTS:
+            distance - signed length of the move (meters, negative backwards)
+            max_speed - cap for this move (m/s)
+
+        OUTPUTS:
+            Signed x_velocity for the move, from the free distance in the
+            corridor swept by the robot along the move
+        '''
+        status, free = swept_path_check(
+                self.get_lidar_scan(), abs(distance),
+                'forward' if distance >= 0 else 'reverse')
+        clearance = None if status == 'unverified' else free
+        speed = linear_speed(clearance, distance, max_speed)
+        return speed if distance >= 0 else -speed
+
+
+
+    async def plan_reverse_speed(self, distance, retries = 0):
+        '''
+        INPUTS:
+            distance - length of the move backwards (meters)
+            retries - times to check again a blocked path before giving up
+
+        OUTPUTS:
+            x_velocity (negative) for a reverse move without obstacle
+            avoidance: from the free space when the swept path is verified
+            clear, the cautious minimum when the lidar can't see it, None
+            when it is blocked
+        '''
+        for attempt in range(retries + 1):
+            status, free = swept_path_check(self.get_lidar_scan(),
+                                            abs(distance), 'reverse')
+            self.metrics.inc('swept_path_checks_total', status = status)
+            if status == 'clear':
+                return -linear_speed(free, distance)
+            if status == 'unverified':
+                return -BASE_LINEAR_SPEED_MIN
+            if attempt < retries:
+                await self.sleep(SWEPT_PATH_RETRY_DELAY)
+
+        self.log.warn(f'Path behind the robot blocked: {free:.2f} m free '
+                      f'for a {abs(distance):.2f} m move')
+        return None
+
+
+
+    async def reverse(self, distance):
+        '''
+        Back off `distance` meters if the swept path allows it. Returns
+        whether the robot moved (False if the path is blocked).
+        '''
+        x_velocity = await self.plan_reverse_speed(distance)
+        if x_velocity is None:
+            self.log.warn(f'Not backing off {distance:.2f} m, path blocked')
+            return False
+        await self.motion.move_linear(distance = distance,
+                                      x_velocity = x_velocity,
+                                      enable_obstacles = False,
+                                      wait = True)
+        return True
+
+
+
+    def plan_angular_speed(self, max_speed = BASE_ANGULAR_SPEED_MAX):
+        '''Rotation speed (deg/s) from the closest return all around'''
+        scan = self.get_lidar_scan()
+        if np.all(np.isnan(scan.ranges)):
+            return angular_speed(None, max_speed)
+        return angular_speed(scan.sector_min(half_width = 180.0), max_speed)
+
+
+
+    def fit_hive_face(self):
+        '''Fit a line to the hive face in the front sector of the lidar'''
+        points = self.get_lidar_scan().points(
+                                max_range = LIDAR_DOCKING_MAX_DISTANCE,
+                                sector = (0.0, LIDAR_DOCKING_SECTOR))
+        return fit_face_ransac(points)
+
+
+
+    async def find_hive_face(self):
+        '''
+        Hive face seen by the lidar, None if lidar docking is disabled or
+        the face found isn't square with angle_to_goal (another wall)
+        '''
+        if not self.setup_args['lidar_docking']:
+            return None
+        face = self.fit_hive_face()
+        if face is None:
+            return None
+
+        current_position = await self.navigation.get_position(
+                                                pos_unit = POSITION_UNIT.METERS,
+                                                ang_unit = ANGLE_UNIT.DEGREES)
+        odometry_error = self.execute_args['angle_to_goal'] - \
+                                                        current_position[2]
+        heading_error = (face.yaw - odometry_error + 180.0) % 360.0 - 180.0
+        if abs(heading_error) > LIDAR_DOCKING_MAX_HEADING_ERROR:
+            self.log.warn(f'Lidar face {heading_error:.1f} deg off the goal '
+                          f'angle, ignoring it')
+            return None
+        return face
+
+
+
+    async def lidar_dock(self, distance_to_goal):
+        '''
+        INPUTS:
+            distance_to_goal - distance to stop from the hive face (meters)
+
+        OUTPUTS:
+            True if the robot got square with the hive face at the wanted
+            distance, False if the face wasn't found. The lateral position
+            is kept as it is, the tag approach corrects it.
+        '''
+        for _ in range(LIDAR_DOCKING_MAX_STEPS):
+            face = await self.find_hive_face()
+            if face is None:
+                return False
+
+            distance_error = face.distance - distance_to_goal
+            if abs(face.yaw) <= LIDAR_DOCKING_YAW_TOLERANCE and \
+                    abs(distance_error) <= LIDAR_DOCKING_DISTANCE_TOLERANCE:
+                return True
+
+            await self.send_feedback({'lidar docking' :
+                                        {'distance error' : distance_error,
+                                         'yaw error' : face.yaw}})
+            if abs(face.yaw) > LIDAR_DOCKING_YAW_TOLERANCE:
+                await self.move_base(
+                    'docking rotation',
+                    lambda: self.motion.rotate(
+                                    angle = face.yaw,
+                                    angular_speed = self.plan_angular_speed(
+                                            BASE_ANGULAR_SPEED_HIVE),
+                                    wait = True))
+
+            if abs(distance_error) > LIDAR_DOCKING_DISTANCE_TOLERANCE:
+                await self.base_motion.wait_done()
+                if distance_error > 0:
+                    x_velocity = self.plan_linear_speed(distance_error)
+                else:
+                    x_velocity = await self.plan_reverse_speed(distance_error)
+                    if x_velocity is None:
+                        return False
+                await self.move_base(
+                    'docking move',
+                    lambda: self.motion.move_linear(
+                        distance = abs(distance_error),
+                        x_velocity = x_velocity,
+                        enable_obstacles = distance_error > 0,
+                        wait = True))
+
+        face = await self.find_hive_face()
+        return face is not None and \
+            abs(face.yaw) <= LIDAR_DOCKING_YAW_TOLERANCE and \
+            abs(face.distance - distance_to_goal) <= \
+                LIDAR_DOCKING_DISTANCE_TOLERANCE
+
+
+
+    async def lidar_predock(self):
+        '''
+        Drive most of the way to the hive with the lidar, square with its
+        face, so that ApproachToTags only makes the last correction with the
+        tags. Needs a face fit with LIDAR_PREDOCK_MIN_INLIERS, square with
+        angle_to_goal and farther than the standoff. Returns whether the
+        robot got to the standoff.
+        '''
+        face = await self.find_hive_face()
+        if face is None or face.inliers < LIDAR_PREDOCK_MIN_INLIERS:
+            return False
+        standoff = self.execute_args['distance_to_goal'] + \
+                                                        LIDAR_PREDOCK_STANDOFF
+        if face.distance - standoff <= LIDAR_DOCKING_DISTANCE_TOLERANCE:
+            return False
+        return await self.lidar_dock(standoff)
+
+
+
+    async def gripper_command(self, command, arm = 'both'):
+        """Opens/closes the gripper of an arm, or both grippers"""
         try:
-            self.log.info(f'Gripper command \'{command}\'...')
-            await self.arms.gripper_cmd(
-                **(GRIPPER_COMMANDS[command]),
-                wait=True,
-            )
+            self.log.info(f'Gripper command \'{command}\' ({arm})...')
+            await self.deadline.run(
+                self.arms.gripper_cmd(
+                    **{**GRIPPER_COMMANDS[command], 'arm' : arm},
+                    wait=True,
+                ),
+                on_timeout = lambda: self.stop_arm(arm))
+        except asyncio.TimeoutError:
+            self.deadline_exceeded()
         except Exception as e:
-            print(e)
+            self.log.warn(f'Gripper command \'{command}\' ({arm}) failed - {e}')
         await self.sleep(2)
 
 
@@ -243,18 +1072,29 @@ class SkillHiveSelection(RayaFSMSkill):
                                  pose,
                                  cartesian_path = True,
                                  planner = 'RRTconnect',
-                                 units = ANGLE_UNIT.DEGREES):
+                                 units = ANGLE_UNIT.DEGREES,
+                                 arm = None,
+                                 profile = 'insertion'):
         '''
             INPUTS:
                 pose: dict with keys of x, y, z, roll, pitch, yaw, and float
                       values
+                arm: arm to move (defaults to self.arm_name)
+                profile: name of the arm motion profile (speed scaling)
 
             OUTPUTS:
                 The function executes forward kinematics to the desired location
         '''
-        
-        await self.arms.set_pose(
-            arm=self.arm_name,
+        arm = arm or self.arm_name
+        target = [pose[key] for key in
+                  ['x', 'y', 'z', 'roll', 'pitch', 'yaw']]
+        if not await self.arm_move_needed('pose', target, arm = arm):
+            return
+
+        self.check_deadline()
+        self.command_arm_move('pose', arm)
+        await self.arm_call(arm, self.arms.set_pose(
+            arm=arm,
             x = pose["x"],
             y = pose["y"],
             z = pose["z"],
@@ -265,81 +1105,279 @@ class SkillHiveSelection(RayaFSMSkill):
             cartesian_path = cartesian_path,
             callback_feedback = self.arms_callback_feedback,
             callback_finish = self.arms_callback_finish,
-            velocity_scaling = 0.1,
-            acceleration_scaling = 0.1,
+            **motion_profile(profile),
             wait = True,
             additional_options = {'planner' : planner}
-        )
+        ))
+        await self.record_arm_move('pose', target,
+                                   expected_position = target[:3], arm = arm)
 
 
 
-    async def return_arm_home(self):
-        await self.static_trex_position()
-        await self.arms.set_predefined_pose(
-                                arm = self.arm_name,
+    async def return_arm_home(self, arm = None):
+        arm = arm or self.arm_name
+        if await self.arm_move_needed('home', arm = arm):
+            await self.static_trex_position(arm, profile = 'retreat')
+            self.command_arm_move('home', arm)
+            await self.arm_call(arm, self.arms.set_predefined_pose(
+                                arm = arm,
                                 predefined_pose = 'home',
                                 callback_feedback = self.arms_callback_feedback,
                                 use_obstacles = True,
-                                wait = True)
+                                wait = True))
+            await self.record_arm_move('home', arm = arm)
+
+        await self.gripper_command('open', arm)
+
+
+
+    async def arm_stowed(self, arm):
+        '''Whether `arm` is still measured in its home or T-rex position'''
+        tracker = self.arm_trackers[arm]
+        if tracker.last_move not in ['home', 'trex']:
+            return False
+        current_pose = await self.arms.get_current_pose(arm)
+        return tracker.reached(current_pose['position'])
+
+
+
+    async def extract_gripper(self, arm):
+        '''Pull the gripper of `arm` straight back out of its cell'''
+        current_pose = await self.arms.get_current_pose(arm)
+        x, y, z = current_pose['position']
+        pose = pre_grasp_pose({'x' : x, 'y' : y, 'z' : z,
+                               'roll' : 0, 'pitch' : 0, 'yaw' : 0},
+                              distance = ARM_EXTRACTION_DISTANCE)
+        await self.forward_kinematics(pose,
+                                      cartesian_path = True,
+                                      arm = arm,
+                                      profile = 'insertion')
+
+
+
+    async def return_arms_home(self):
+        '''Return every arm picking the current target(s) home'''
+        await self.move_arms({arm : self.return_arm_home(arm)
+                              for arm in self.picking_arms()},
+                             retract = False)
 
-        await self.gripper_command('open')
+
+
+    async def arm_move_needed(self, move, target = None, arm = None):
+        '''
+        INPUTS:
+            move - name of the arm move ('trex', 'home', 'pose')
+            target - joints or pose target of the move, if it has one
+            arm - arm to move (defaults to self.arm_name)
+
+        OUTPUTS:
+            False if `move` was the last move commanded and the arm is still
+            measured where it left it, so the move can be skipped
+        '''
+        arm = arm or self.arm_name
+        tracker = self.arm_trackers[arm]
+        if not tracker.matches(move, target):
+            return True
+
+        current_pose = await self.arms.get_current_pose(arm)
+        if not tracker.reached(current_pose['position']):
+            return True
+
+        tracker.moves_skipped += 1
+        self.metrics.inc('arm_moves_skipped_total', move = move, arm = arm)
+        self.log.debug(f'{arm} already in {move} position, skipping move')
+        return False
+
+
+
+    def command_arm_move(self, move, arm):
+        '''Count `move` of `arm` as commanded, whether it gets there or not'''
+        self.arm_trackers[arm].commanded()
+        self.metrics.inc('arm_moves_commanded_total', move = move, arm = arm)
+
+
+
+    async def record_arm_move(self, move, target = None,
+                              expected_position = None, arm = None):
+        '''Store a finished arm move with the position measured after it'''
+        arm = arm or self.arm_name
+        current_pose = await self.arms.get_current_pose(arm)
+        if expected_position is not None and not all(
+                abs(np.array(current_pose['position']) - expected_position) <= \
+                ARM_ERROR_THRESHOLD):
+            # Didn't get there, the move must not be skipped on retry
+            self.arm_trackers[arm].invalidate()
+        else:
+            self.arm_trackers[arm].record(move, target,
+                                          current_pose['position'])
+        return current_pose
 
 
 
     async def turn_and_burn(self, distance):
         '''Turn 90 degrees, move forwards, turn back'''
-        await self.motion.rotate(angle = 90,
-                                 angular_speed = 15,
-                                 wait = True)
-        
-        await self.motion.move_linear(distance = distance,
-                                      x_velocity = 0.05,
-                                      wait = True)
+        await self.with_deadline(
+            self.motion.rotate(angle = 90,
+                               angular_speed = self.plan_angular_speed(
+                                            BASE_ANGULAR_SPEED_SIDEWAYS),
+                               wait = True),
+            on_timeout = self.motion.cancel_motion)
+
+        await self.with_deadline(
+            self.motion.move_linear(distance = distance,
+                                    x_velocity = self.plan_linear_speed(distance),
+                                    wait = True),
+            on_timeout = self.motion.cancel_motion)
 
-        await self.motion.rotate(angle = -90,
-                                 angular_speed = 15,
-                                 wait = True)
+        await self.with_deadline(
+            self.motion.rotate(angle = -90,
+                               angular_speed = self.plan_angular_speed(
+                                            BASE_ANGULAR_SPEED_SIDEWAYS),
+                               wait = True),
+            on_timeout = self.motion.cancel_motion)
 
 
 
-    async def static_trex_position(self):
+    async def static_trex_position(self, arm = None, profile = 'transit'):
         '''Position arm in trex position'''
-        await self.arms.set_joints_position(
-            arm=self.arm_name,
-            name_joints=self.joint_names,
-            angle_joints = TREX_POSITION_ANGLES,
+        arm = arm or self.arm_name
+        arm_profile = ARM_PROFILES[arm]
+        if not await self.arm_move_needed('trex', arm_profile['trex_angles'],
+                                          arm = arm):
+            return
+
+        self.check_deadline()
+        self.command_arm_move('trex', arm)
+        await self.arm_call(arm, self.arms.set_joints_position(
+            arm=arm,
+            name_joints=arm_profile['joint_names'],
+            angle_joints = arm_profile['trex_angles'],
             units = ANGLE_UNIT.RADIANS,
             use_obstacles = True,
             save_trajectory = True,
-            name_trajectory = 'trex_position',
-            velocity_scaling = 0.4,
-            acceleration_scaling =  0.4,
-            wait=True)
+            name_trajectory = f'trex_position_{arm}',
+            **motion_profile(profile),
+            wait=True))
 
-        self.static_trex_pose = await self.arms.get_current_pose(self.arm_name)
+        self.static_trex_pose = await self.record_arm_move(
+                                'trex', arm_profile['trex_angles'], arm = arm)
         self.static_trex = self.static_trex_pose['position']
 
 
 
-    async def dynamic_trex_position(self, pickup_height = 0):
-        '''Position arm in trex position'''
-        self.trex_pose = {
-        'x' : self.target_x + RIGHT_ARM_OFFSET['x'] + CELL_SIZE_X,
-        'y' : self.target_y + RIGHT_ARM_OFFSET['y'],
-        'z' : self.target_z + RIGHT_ARM_OFFSET['z'] + CELL_SIZE_Z + pickup_height,
+    async def static_trex_positions(self, arms, profile = 'transit'):
+        '''Position several arms in trex position at once'''
+        await self.move_arms({arm : self.static_trex_position(arm, profile)
+                              for arm in arms})
+
+
+
+    def get_trex_pose(self, target_x, target_y, target_z, pickup_height = 0,
+                      arm = None):
+        '''Pose of `arm` in front of the cell of a tag at target_x/y/z'''
+        offset = ARM_PROFILES[arm or self.arm_name]['offset']
+        return {
+        'x' : target_x + offset['x'] + CELL_SIZE_X,
+        'y' : target_y + offset['y'],
+        'z' : target_z + offset['z'] + CELL_SIZE_Z + pickup_height,
         'roll' : 0,
         'pitch' : 0,
         'yaw' : 0
         }
-        
-        self.dynamic_trex = [self.trex_pose['x'],
-                              self.trex_pose['y'],
-                              self.trex_pose['z']]
 
 
-        await self.forward_kinematics(self.trex_pose,
+
+    async def dynamic_trex_position(self, pickup_height = 0):
+        '''Position the picking arms in front of their target cells'''
+        moves = {}
+        for arm, (target_x, target_y, target_z) in self.arm_targets.items():
+            trex_pose = self.get_trex_pose(target_x, target_y, target_z,
+                                           pickup_height, arm = arm)
+            self.dynamic_trex[arm] = [trex_pose['x'],
+                                      trex_pose['y'],
+                                      trex_pose['z']]
+            moves[arm] = self.approach_pose(trex_pose, arm)
+        await self.move_arms(moves)
+
+
+
+    async def approach_pose(self, pose, arm):
+        '''
+        Move `arm` to `pose` in two legs: a fast move to a pre-grasp pose
+        short of the cell, then the slow final approach into it. The first
+        leg is skipped when the arm is already that close to `pose`.
+        '''
+        current_pose = await self.arms.get_current_pose(arm)
+        position = current_pose['position']
+        target = [pose['x'], pose['y'], pose['z']]
+        if np.linalg.norm(np.subtract(target, position)) > \
+                ARM_FINAL_APPROACH_DISTANCE + ARM_ERROR_THRESHOLD[0]:
+            pre_grasp = pre_grasp_pose(pose)
+            move_distance = np.linalg.norm(np.subtract(
+                    [pre_grasp['x'], pre_grasp['y'], pre_grasp['z']], position))
+            profile = choose_motion_profile(
+                    move_distance,
+                    hive_clearance(position, self.target['all_tags']))
+            await self.forward_kinematics(pre_grasp,
+                                          planner = 'RRTconnect',
+                                          arm = arm,
+                                          profile = profile)
+
+        await self.forward_kinematics(pose,
                                       #cartesian_path = True,
-                                      planner = 'RRTconnect')
+                                      planner = 'RRTconnect',
+                                      arm = arm,
+                                      profile = 'insertion')
+
+
+
+    def select_arm(self, position):
+        '''Arm picking at `position`: the configured one or the nearest'''
+        if self.arm_selection == 'auto':
+            return nearest_arm(position, self.selectable_arms)
+        return self.arm_selection
+
+
+
+    async def staging_arm(self):
+        '''
+        Arm expected to pick the target seen now, where it will be after
+        moving sideways. The target is only chosen in DETECTING_TAGS_2.
+        '''
+        target = await self.choose_next_target()
+        if target['tag'] is None:
+            return self.arm_name
+        x, y, z = target['tag'][1]
+        return self.select_arm([x, y - (self.pixels2meters() or 0.0), z])
+
+
+
+    def assign_arms(self):
+        '''Give the target, and a neighbouring one in dual mode, to the arms'''
+        position = [self.target_x, self.target_y, self.target_z]
+        pair = None
+        if self.dual_arm:
+            pair = pair_targets(position, self.target['all_tags'])
+
+        if pair is not None:
+            self.arm_targets = pair
+        else:
+            self.arm_targets = {self.select_arm(position) : position}
+        self.arm_name = nearest_arm(position, self.arm_targets)
+        self.target['arms'] = self.arm_targets
+
+
+
+    def picking_arms(self):
+        '''Arms picking the current target(s)'''
+        return list(self.arm_targets) or [self.arm_name]
+
+
+
+    def gripper_arm(self):
+        '''Gripper argument for the picking arms: one arm or 'both' '''
+        arms = self.picking_arms()
+        return arms[0] if len(arms) == 1 else 'both'
     
 
     def pixels2meters(self):
@@ -360,12 +1398,112 @@ class SkillHiveSelection(RayaFSMSkill):
 
             # Semi automatic correction in case of inaccuracies
             if side_linear > 0.4  or side_linear < 0.275:
-                side_linear =  0.32 + y_base_dist_meters
+                side_linear =  SIDEWAYS_TAG_OFFSET + y_base_dist_meters
             
                 return side_linear
 
 
 
+    async def dry_run(self):
+        '''
+        Predict the pick from the current and recorded sensor data without
+        sending any motion command.
+
+        OUTPUTS:
+            Dict with the feasibility, the reasons if it isn't feasible, the
+            total estimated duration and the estimated duration of each state
+        '''
+        plan = DryRunPlan()
+
+        # Navigation goal
+        position = await self.navigation.get_position(
+                                                pos_unit = POSITION_UNIT.METERS,
+                                                ang_unit = ANGLE_UNIT.DEGREES)
+        distance = navigation_distance(position, NAV_POINT_CART)
+        plan.add('NAVIGATING_TO_HIVE',
+                 linear_duration(distance, DRY_RUN_NAV_SPEED),
+                 distance = distance)
+
+        # Tags seen from the current position, as DETECTING_TAGS_1 would
+        await self.resources.sync_phase(PHASE_RESOURCES['DETECTING_TAGS_1'])
+        self.reset_detections()
+        self.detection_subscription.paused = False
+        await self.sleep(DETECTION_SCAN_TIME)
+        self.detection_subscription.paused = True
+        await self.resources.sync_phase([])
+        detected = await self.choose_next_target() if self.tags_detected \
+                        else None
+
+        # Tag approach, refined with the lidar if the hive face is visible
+        face = await self.find_hive_face()
+        plan.add('APPROACHING_HIVE', method = 'camera',
+                 lidar_refinement = face is not None)
+
+        # Target selection from the recorded hive inventory, otherwise from
+        # the tags detected now
+        record = self.inventory.get(self.setup_args['map_name'], self.hive_name)
+        target, source = None, 'unknown'
+        if record:
+            target, source = record['next_target']['position'], 'inventory'
+        elif detected is not None and detected['tag'] is not None:
+            target, source = detected['tag'][1], 'detections'
+        if record:
+            plan.add('DETECTING_TAGS_1',
+                     extra_duration = INVENTORY_CONFIRMATION_TIME - \
+                                      DETECTION_SCAN_TIME,
+                     target = target, source = source)
+        else:
+            plan.add('DETECTING_TAGS_1', target = target, source = source)
+
+        # Sideways offset, from the detections or the recorded target
+        sideways_distance = self.pixels2meters()
+        if sideways_distance is None and target is not None:
+            sideways_distance = SIDEWAYS_TAG_OFFSET + target[1]
+        plan.add('MOVING_SIDEWAYS',
+                 rotation_duration(180.0) +
+                 linear_duration(sideways_distance or 0.0),
+                 sideways_distance = sideways_distance)
+        if sideways_distance is not None and sideways_distance < 0:
+            plan.infeasible(f'Negative sideways distance {sideways_distance}')
+
+        if record:
+            plan.add('DETECTING_TAGS_2',
+                     duration = 1.5 + INVENTORY_CONFIRMATION_TIME,
+                     confirmation_only = True)
+        else:
+            plan.add('DETECTING_TAGS_2', confirmation_only = False)
+
+        # Arm pose feasibility
+        if target is not None:
+            arm = self.select_arm(target)
+            pose = self.get_trex_pose(*target, arm = arm)
+            try:
+                valid = bool(await self.arms.is_pose_valid(
+                    arm = arm,
+                    x = pose['x'], y = pose['y'], z = pose['z'],
+                    roll = pose['roll'], pitch = pose['pitch'],
+                    yaw = pose['yaw'],
+                    units = ANGLE_UNIT.DEGREES,
+                    cartesian_path = False,
+                    use_obstacles = True))
+            except Exception as e:
+                valid = None
+                self.log.warn(f'Couldnt check the arm pose - {e}')
+            if valid is not None and not valid:
+                plan.infeasible(f'Arm pose not reachable: {pose}')
+            plan.add('POSITION_ARM', arm = arm, pose = pose, valid = valid)
+        else:
+            plan.add('POSITION_ARM', pose = None, valid = None)
+        plan.add('PICK_ITEM')
+
+        result = plan.as_dict()
+        if result['estimated_duration'] > self.deadline.remaining():
+            plan.infeasible('Estimated duration exceeds the pick deadline')
+            result = plan.as_dict()
+        return result
+
+
+
     async def check_navigation_success(self):
         robot_meter_deg = await self.navigation.get_position(
                                                 pos_unit=POSITION_UNIT.METERS,
@@ -384,10 +1522,95 @@ class SkillHiveSelection(RayaFSMSkill):
         '''Reset the detections'''
         self.tags_detected = False
         self.detections_dict = {}
+        self.detections_array = detections_to_array([])
+        self.detection_subscription.reset()
         self.target_x, self.target_y, self.target_z = None, None, None
 
 
 
+    def set_target(self, target):
+        '''Set the target cell to pick the item from'''
+        self.target = target
+        self.num_detections = self.target['num_detections']
+        self.target_x = self.target['tag'][1][0]
+        self.target_y = self.target['tag'][1][1]
+        self.target_z = self.target['tag'][1][2]
+        self.assign_arms()
+
+
+
+    def fit_hive(self):
+        '''
+        Fit the hive board pose to the visible tags of the hive. None if
+        there are too few tags or the fit isn't good.
+        '''
+        detections = select_tag(self.detections_array, self.tag_id)
+        frame = fit_hive_frame(detections['xyz'])
+        if frame is None or frame.residual > HIVE_FIT_MAX_RESIDUAL:
+            return None
+
+        self.log.debug(f'Hive board fitted to {frame.n_tags} tags, '
+                       f'residual: {frame.residual:.4f} m')
+        return frame
+
+
+
+    def anchor_hive(self):
+        '''
+        Fit the hive board while docked to the hive, counting its cells from
+        the hive origin so they are the same cells from one pick to the next.
+        The cells of the visible tags are kept to align the later fits.
+        '''
+        frame = self.fit_hive()
+        if frame is None:
+            self.board_cells = None
+            return None
+
+        frame.anchor(self.inventory.origin(self.setup_args['map_name'],
+                                           self.hive_name, frame))
+        self.board_cells = visible_cells(
+                frame, select_tag(self.detections_array, self.tag_id)['xyz'])
+        return frame
+
+
+
+    def align_hive(self, cells = ()):
+        '''
+        Fit the hive board once the robot moved away from the docked pose,
+        counting its cells as the cells seen while docked (and `cells`, e.g.
+        the picked one). None if there is no fit or it can't be aligned.
+        '''
+        frame = self.fit_hive()
+        if frame is None or self.board_cells is None:
+            return None
+        points = select_tag(self.detections_array, self.tag_id)['xyz']
+        if not frame.align(self.board_cells + list(cells), points):
+            self.log.debug('Hive board not aligned to the docked cells')
+            return None
+        return frame
+
+
+
+    def refine_target(self, target, frame, cell = None):
+        '''
+        Replace the target position by the fitted position of its cell (or
+        of `cell` if given), which is less noisy than a single tag. The
+        target is kept as it is if there is no board fit.
+        '''
+        if frame is None:
+            return target
+
+        self.hive_frame = frame
+        if cell is None:
+            cell = frame.cell_of([target['tag'][1]])[0]
+        target['tag'] = (target['tag'][0],
+                         frame.cell_position(*cell).tolist())
+        target['cells'] = frame.cell_positions(HIVE_NUM_ROWS,
+                                               HIVE_NUM_COLS).tolist()
+        return target
+
+
+
     def create_dict_arg(self, arg_list):
         '''Taken from pyraya_examples/cv_tags'''
         dict_r = {}
@@ -403,45 +1626,29 @@ class SkillHiveSelection(RayaFSMSkill):
     async def choose_next_target(self, n_rows = None, n_cols = None):
         '''Choose the cell from which to take the item'''
 
-        # Get the current detections
-        tags_dict = {}
-        detected_ids = []
-        tags = self.predictor_handler.get_current_detections()
-
-        # Put the relevant info (id and position) in a dict, if more than one
-        # tag is detected, add a residual id (e.g 4.1, 4.2...)
-        for tag in tags:
-            current_id = tag['tag_id']
-            if current_id == self.tag_id:
-                current_position = [tag['pose_base_link'].pose.position.x,
-                                    tag['pose_base_link'].pose.position.y,
-                                    tag['pose_base_link'].pose.position.z]
-                detected_ids.append(current_id)
-                residual_id = detected_ids.count(current_id) - 1
-                tags_dict[f'{current_id}.{residual_id}'] = current_position
+        # Last detections of the item tag, as normalised by the callback
+        detections = select_tag(self.detections_array, self.tag_id)
+        positions = detections['xyz']
+        num_detections = len(detections)
+        chosen_tag, chosen_row, chosen_col = None, None, None
 
         # Sort the tags based on their y axis location (in ascending order)
         # and if the y axis ties then based on the x axis (in descending order)
-        if len(tags_dict) > 0:
-            sorted_tags = sorted(
-                    tags_dict.items(),
-                    key = lambda point: (round(point[1][1], 1), -point[1][0]))
-            
-            self.closest_tag_x = min(tags_dict.items(),
-                                key = lambda point: point[1][0])[1][0]
+        if num_detections > 0:
+            sorted_positions = sort_targets(detections)['xyz']
+            self.closest_tag_x = float(positions[:, 0].min())
 
-            # Choose the next target (go from right to left and from front to back)
-            num_detections = len(sorted_tags)
-            chosen_tag = sorted_tags[0]
+            # Choose the next target (go from right to left and from front to
+            # back). If more than one tag is detected, the id gets a residual
+            # (e.g 4.0, 4.1...)
+            chosen_tag = (f'{self.tag_id}.0', sorted_positions[0].tolist())
 
             if n_rows and n_cols:
-                chosen_col = len(sorted_tags) // n_rows - n_cols + 2
-                chosen_row = (len(sorted_tags) - n_cols) % n_cols + 1
+                chosen_col = num_detections // n_rows - n_cols + 2
+                chosen_row = (num_detections - n_cols) % n_cols + 1
 
-            else:
-                chosen_col, chosen_row = None, None
-        
         next_target = {'tag' : chosen_tag,
+                       'all_tags' : positions.tolist(),
                        'num_detections' : num_detections,
                        'row' : chosen_row,
                        'col' : chosen_col}
@@ -488,18 +1695,27 @@ class SkillHiveSelection(RayaFSMSkill):
 
     def callback_predictions(self, predictions, image):
         '''Callback used to obtain predictions'''
+        if not self.detection_subscription.frame_wanted():
+            return
+
         self.image = image
+        detections = detections_to_array(predictions)
+        if not self.detection_subscription.changed(detections):
+            return
+
+        self.detections_array = detections
         if predictions:
             for pred in predictions:
                 tag_id = pred['tag_id']
                 self.detections_dict[tag_id] = pred
 
-            if self.tag_id in self.detections_dict:
-                # self.target_x = self.detections_dict[self.tag_id]['pose_base_link'].pose.position.x
-                # self.target_y = self.detections_dict[self.tag_id]['pose_base_link'].pose.position.y
-                # self.target_z = self.detections_dict[self.tag_id]['pose_base_link'].pose.position.z
+            if np.any(self.detections_array['tag_id'] == self.tag_id):
                 self.tags_detected = True
 
+        if self.visualizer is not None:
+            self.visualizer.submit(image, detections)
+            self.visualizer.show_pending()
+
 
 
     def callback_specific_tags(self, detected_tag, tag_info, timestamp):
@@ -515,20 +1731,41 @@ class SkillHiveSelection(RayaFSMSkill):
 
     async def enter_NAVIGATING_TO_HIVE(self):
         '''Action used to navigate to the cart'''
-        await self.navigation.navigate_to_position(x = NAV_POINT_CART['x'],
-                                                   y = NAV_POINT_CART['y'],
-                                                   #angle = self.execute_args['angle_to_goal'],
-                                                   angle = 40.0,
-                                                   pos_unit = POSITION_UNIT.METERS,
-                                                   ang_unit = ANGLE_UNIT.DEGREES,
-                                                   wait = True)
+        position = await self.navigation.get_position(
+                                                pos_unit = POSITION_UNIT.METERS,
+                                                ang_unit = ANGLE_UNIT.DEGREES)
+        await self.sync_phase_resources(expected_duration = \
+                navigation_distance(position, NAV_POINT_CART) / \
+                    CAMERA_PREWARM_NAV_SPEED)
+        await self.wait_checkpoint_pose()
+        await self.with_deadline(
+            self.navigation.navigate_to_position(x = NAV_POINT_CART['x'],
+                                                 y = NAV_POINT_CART['y'],
+                                                 #angle = self.execute_args['angle_to_goal'],
+                                                 angle = 40.0,
+                                                 pos_unit = POSITION_UNIT.METERS,
+                                                 ang_unit = ANGLE_UNIT.DEGREES,
+                                                 wait = True),
+            on_timeout = self.navigation.cancel_navigation)
 
 
 
     async def enter_APPROACHING_HIVE(self):
         '''Action used to execute the approach skill'''
+        await self.sync_phase_resources()
 
         self.approach_successful = False
+
+        # A confident fit of the hive face takes the robot most of the way
+        if await self.lidar_predock():
+            self.log.info('Approach shortened with the lidar')
+
+        front_clearance = self.get_front_clearance()
+        approach_distance = 0.0
+        if front_clearance is not None and np.isfinite(front_clearance):
+            approach_distance = front_clearance - \
+                                self.execute_args['distance_to_goal']
+        await self.wait_checkpoint_pose()
         self.log.info('Executing ApproachToTags skill...')
         await self.skill_approach.execute_setup(
              setup_args = {
@@ -543,7 +1780,9 @@ class SkillHiveSelection(RayaFSMSkill):
                 'angle_to_goal' : self.execute_args['angle_to_goal'],
                 'distance_to_goal': self.execute_args['distance_to_goal'],
                 'identifier': self.execute_args['identifier'],
-                'linear_velocity': 0.06,
+                'linear_velocity': self.plan_linear_speed(
+                                        approach_distance,
+                                        max_speed = BASE_APPROACH_SPEED_MAX),
                 'max_x_error_allowed': 0.03,
                 'max_y_error_allowed': 0.02,
                 'max_angle_error_allowed' : 3.0,
@@ -554,7 +1793,8 @@ class SkillHiveSelection(RayaFSMSkill):
             callback_done = self.skill_callback_done
         )
 
-        await self.skill_approach.wait_main()
+        await self.with_deadline(self.skill_approach.wait_main(),
+                                 on_timeout = self.skill_approach.execute_finish)
         await self.skill_approach.execute_finish()
         await self.check_approach_success(
                 thresh = self.execute_args['distance_to_goal'] + 0.1,
@@ -563,77 +1803,65 @@ class SkillHiveSelection(RayaFSMSkill):
 
 
     async def enter_DETECTING_TAGS_1(self):
-         # Enable model
-        self.log.info('Enabling apriltags model...')
-
-        self.predictor_handler = await self.cv.enable_model(
-                model = 'detector',type = 'tag',
-                name = 'apriltags', 
-                source = self.setup_args['working_camera_2'],
-                model_params = {
-                'families' : 'tag36h11',
-                'nthreads' : 4,
-                'quad_decimate' : 2.0,
-                'quad_sigma': 0.0,
-                'decode_sharpening' : 0.25,
-                'refine_edges' : 1,
-                'tag_size' : self.setup_args['tag_size']
-                }
-            )
-        
-         # Create listeners
-        await self.predictor_handler.find_tags(
-                tags = self.tags_info, 
-                callback = self.callback_specific_tags
-            )
-        
-        self.predictor_handler.set_img_detections_callback(
-                callback = self.callback_predictions,
-                as_dict = True,
-                call_without_detections = True,
-                cameras_controller = self.cameras
-            )
+        await self.sync_phase_resources()
 
-        # Start timer
-        self.detection_start_time = time.time()
+        # Known hive, a short detection is enough to confirm the record
+        self.predicted_target = self.inventory.get(
+                self.setup_args['map_name'], self.hive_name)
+        if self.predicted_target is not None:
+            await self.send_feedback(
+                {'predicted target' : self.predicted_target['next_target']})
 
 
 
     async def enter_MOVING_SIDEWAYS(self):
-        await self.sleep(1.5)
-        await self.turn_and_burn(self.sideways_distance)
+        await self.sync_phase_resources()
+        self.sideways_motion = await self.move_base(
+                'sideways', lambda: self.turn_and_burn(self.sideways_distance),
+                wait = False)
 
     
 
     async def enter_DETECTING_TAGS_2(self):
-        # Start timer (model is already enabled)
+        await self.sync_phase_resources()
+
+        # Let the detections come in (model is already enabled)
         await self.sleep(1.5)
-        self.detection_start_time = time.time()
 
 
 
     async def enter_POSITION_ARM(self):
         '''Action used to position the arm before grabbing the item'''
+        await self.sync_phase_resources()
+
         # Try to position the arm dynamically (according to tags location)
         try:
-            await self.static_trex_position()
+            await self.static_trex_positions(self.picking_arms())
             await self.dynamic_trex_position()
 
         # Try to position the arm statically (according to const joints values)
         except Exception as e:
+            if self.deadline.budget() <= 0.0:
+                raise   # Out of time, the pick is aborting
             self.log.warn(f'Couldnt POSITION_ARM - {e}. \
                           Attempts: {self.position_attempts}...')
 
     
 
     async def enter_PICK_ITEM(self):
-        await self.gripper_command('close')
+        await self.sync_phase_resources()
+        await self.gripper_command('close', self.gripper_arm())
         #await self.dynamic_trex_position(pickup_height = PICKUP_HEIGHT)
         
-        await self.arms.set_joint_position(arm = self.arm_name,
-                                           joint = 'arm_right_shoulder_rail_joint',
-                                           position = 0.0,
-                                           wait = True)
+        moves = {}
+        for arm in self.picking_arms():
+            self.arm_trackers[arm].invalidate()
+            moves[arm] = self.arm_call(arm, self.arms.set_joint_position(
+                                        arm = arm,
+                                        joint = ARM_PROFILES[arm]['rail_joint'],
+                                        position = 0.0,
+                                        wait = True))
+        await self.move_arms(moves)
 
 
 
@@ -646,37 +1874,7 @@ class SkillHiveSelection(RayaFSMSkill):
 
         await self.gripper_command('open')
         await self.return_arm_home()
-
-         # Enable model
-        self.log.info('Enabling apriltags model...')
-
-        self.predictor_handler = await self.cv.enable_model(
-                model = 'detector',type = 'tag',
-                name = 'apriltags', 
-                source = self.setup_args['working_camera_2'],
-                model_params = {
-                'families' : 'tag36h11',
-                'nthreads' : 4,
-                'quad_decimate' : 2.0,
-                'quad_sigma': 0.0,
-                'decode_sharpening' : 0.25,
-                'refine_edges' : 1,
-                'tag_size' : self.setup_args['tag_size']
-                }
-            )
-        
-         # Create listeners
-        await self.predictor_handler.find_tags(
-                tags = self.tags_info, 
-                callback = self.callback_specific_tags
-            )
-        
-        self.predictor_handler.set_img_detections_callback(
-                callback = self.callback_predictions,
-                as_dict = True,
-                call_without_detections = True,
-                cameras_controller = self.cameras
-            )
+        await self.sync_phase_resources()
 
         # Start timer
         self.detection_start_time = time.time()
@@ -702,10 +1900,16 @@ class SkillHiveSelection(RayaFSMSkill):
     async def transition_from_APPROACHING_HIVE(self):
         if self.approach_successful:
             self.approach_successful = False
-            current_position = await self.navigation.get_position(
+            # Measure the angle error on the hive face when it's visible,
+            # otherwise infer it from odometry
+            face = await self.find_hive_face()
+            if face is not None:
+                self.approach_angle_error = face.yaw
+            else:
+                current_position = await self.navigation.get_position(
                                                 pos_unit = POSITION_UNIT.METERS,
                                                 ang_unit = ANGLE_UNIT.DEGREES)
-            self.approach_angle_error = self.execute_args['angle_to_goal'] - \
+                self.approach_angle_error = self.execute_args['angle_to_goal'] - \
                                                             current_position[2] 
             self.set_state('DETECTING_TAGS_1')
         
@@ -718,12 +1922,44 @@ class SkillHiveSelection(RayaFSMSkill):
     
 
     async def transition_from_DETECTING_TAGS_1(self):
-        await self.sleep(1.5)
+        if self.predicted_target is not None:
+            await self.sleep(INVENTORY_CONFIRMATION_TIME)
+        else:
+            await self.sleep(DETECTION_SCAN_TIME)
+
         if self.tags_detected:
+            # Still docked, count the cells of the hive from its origin
+            self.anchor_hive()
+            if self.predicted_target is not None and \
+                    not self.inventory.confirms(self.predicted_target,
+                                                self.board_cells):
+                # The hive changed since the last pick, do a full scan
+                self.log.warn('Hive inventory outdated, scanning again...')
+                self.inventory.forget(self.setup_args['map_name'],
+                                      self.hive_name)
+                self.predicted_target = None
+                return
+
             self.tags_detected = False
-            await self.motion.rotate(angle = self.approach_angle_error,
-                                    angular_speed = 10,
-                                    wait = True)
+            # Pre-stage the arm in T-rex while rotating if there's room,
+            # once the back off (if any) stopped and the clearance is known
+            self.arm_name = await self.staging_arm()
+            await self.base_motion.wait_done()
+            arm_stowed = await self.arm_stowed(self.arm_name)
+            await self.motion_coordinator.run(
+                arm_coro = self.static_trex_position(self.arm_name),
+                base_coro = self.move_base(
+                    'angle correction',
+                    lambda: self.motion.rotate(
+                                    angle = self.approach_angle_error,
+                                    angular_speed = self.plan_angular_speed(
+                                            BASE_ANGULAR_SPEED_HIVE),
+                                    wait = True)),
+                base_motion = 'rotate',
+                front_clearance = self.get_front_clearance(),
+                arm_clear = arm_stowed,
+                arm_optional = True
+            )
             
             self.sideways_distance = self.pixels2meters()
             await self.send_feedback(
@@ -732,46 +1968,76 @@ class SkillHiveSelection(RayaFSMSkill):
             )
             self.set_state('MOVING_SIDEWAYS')
 
+        elif self.deadline.budget() <= 0.0:
+            self.deadline_exceeded()
+
         else:
-            await self.motion.move_linear(distance = 0.07,
-                                            x_velocity = -0.05,
-                                            enable_obstacles = False,
-                                            wait = False)
+            # Backing off can't help if the last back off was blocked
+            if self.back_off is not None and not await self.back_off:
+                self.abort(*ERROR_PATH_BLOCKED)
 
-        if (time.time() - self.detection_start_time) > NO_TARGET_TIMEOUT:
-            self.abort(*ERROR_TAG_NOT_FOUND)
+            # Don't wait, the detections keep running while backing off.
+            # The path is checked when the move starts, not now
+            self.back_off = await self.move_base(
+                    'back off', lambda: self.reverse(0.07), wait = False)
 
     
 
     async def transition_from_MOVING_SIDEWAYS(self):
-        if not self.motion.is_moving(): 
-            self.set_state('DETECTING_TAGS_2')
+        # Raises the motion error, if any
+        await self.sideways_motion
+        self.set_state('DETECTING_TAGS_2')
 
 
 
     async def transition_from_DETECTING_TAGS_2(self):
         self.reset_detections()
-        await self.sleep(1.5)
+        if self.predicted_target is not None:
+            await self.sleep(INVENTORY_CONFIRMATION_TIME)
+        else:
+            await self.sleep(DETECTION_SCAN_TIME)
+
         if self.tags_detected:
             self.tags_detected = False
+            target = await self.choose_next_target(HIVE_NUM_ROWS, HIVE_NUM_COLS)
+            aligned = self.align_hive()
+            frame = aligned if aligned is not None else self.fit_hive()
+            cell = None
+            if aligned is not None and self.predicted_target is not None:
+                # Board confirmed while docked, use the recorded cell
+                cell = self.predicted_target['next_target']['cell']
+                target['row'] = self.predicted_target['next_target']['row']
+                target['col'] = self.predicted_target['next_target']['col']
+
+            self.set_target(self.refine_target(target, frame, cell))
+            # Its tag shows after pickup, to align the board then
+            self.target_cell = None if aligned is None else \
+                    aligned.cell_of([self.target['tag'][1]])[0].tolist()
+            await self.send_feedback(self.target)
             self.set_state('POSITION_ARM')
         
-        elif (time.time() - self.detection_start_time) > NO_TARGET_TIMEOUT:
-            self.abort(*ERROR_TAG_NOT_FOUND)
+        elif self.deadline.budget() <= 0.0:
+            self.deadline_exceeded()
 
 
 
     async def transition_from_POSITION_ARM(self):
-        current_pose = await self.arms.get_current_pose(self.arm_name)
-        current_position = np.array(current_pose['position'])
-        if all(abs(current_position - self.dynamic_trex) <= ARM_ERROR_THRESHOLD):
+        arms_positioned = bool(self.dynamic_trex)
+        for arm, dynamic_trex in self.dynamic_trex.items():
+            current_pose = await self.arms.get_current_pose(arm)
+            current_position = np.array(current_pose['position'])
+            if not all(abs(current_position - dynamic_trex) <= \
+                       ARM_ERROR_THRESHOLD):
+                arms_positioned = False
+
+        if arms_positioned:
             self.set_state('PICK_ITEM')
 
         else:
             self.position_attempts += 1
 
             if self.position_attempts > MAX_POSITION_ATTEMPTS:
-                await self.return_arm_home()
+                await self.return_arms_home()
                 self.abort(*ERROR_COULDNT_POSITION_ARM)
 
             self.next_state = 'POSITION_ARM'
@@ -782,27 +2048,64 @@ class SkillHiveSelection(RayaFSMSkill):
 
 
     async def transition_from_PICK_ITEM(self):
+        # Only count the tags seen once the item was lifted
+        self.detections_array = detections_to_array([])
+        self.detection_subscription.reset()
         await self.sleep(2.0)
         current_target = await self.choose_next_target(HIVE_NUM_ROWS, HIVE_NUM_COLS)
-        if current_target['num_detections'] - self.num_detections == 1:
-            await self.send_feedback('Pickup confirmed!')
+        picking_arms = self.picking_arms()
+        if current_target['num_detections'] - self.num_detections == \
+                len(picking_arms):
+            await self.send_feedback(f'Pickup confirmed! ({picking_arms})')
+            for arm in picking_arms:
+                self.metrics.inc('items_picked_total', arm = arm)
+            self.inventory.record_pickup(
+                    self.setup_args['map_name'], self.hive_name,
+                    frame = self.align_hive([self.target_cell]
+                                            if self.target_cell else []),
+                    next_target = current_target)
+            # The item is lifted (rail), pull the grippers out of the cells
+            # before the base moves
+            await self.move_arms({arm : self.extract_gripper(arm)
+                                  for arm in picking_arms})
+
             await self.send_feedback(f'Moving backwards: \
                             {0.15 + self.closest_tag_x - self.target_x} meters')
-            await self.motion.move_linear(
-                    distance = 0.15 + abs(self.closest_tag_x - self.target_x),
-                    x_velocity = -0.05,
-                    enable_obstacles = False,
-                    wait = True)
-            await self.static_trex_position()
+            retreat_distance = 0.15 + abs(self.closest_tag_x - self.target_x)
+            retreat_velocity = await self.plan_reverse_speed(
+                        retreat_distance, retries = SWEPT_PATH_RETRIES)
+            if retreat_velocity is None:
+                # Pull the arms out of the cell before giving up
+                try:
+                    await self.static_trex_positions(picking_arms,
+                                                     profile = 'retreat')
+                except Exception as e:
+                    self.log.error(f'Couldnt retract the arms - {e}')
+                    raise
+                self.abort(*ERROR_PATH_BLOCKED)
+            await self.motion_coordinator.run(
+                arm_coro = self.static_trex_positions(picking_arms,
+                                                      profile = 'retreat'),
+                base_coro = self.move_base(
+                    'retreat',
+                    lambda: self.motion.move_linear(
+                        distance = retreat_distance,
+                        x_velocity = retreat_velocity,
+                        enable_obstacles = False,
+                        wait = True)),
+                base_motion = 'reverse',
+                front_clearance = self.get_front_clearance(),
+                arm_clear = True
+            )
             self.set_state('END')
 
         else:
             self.pickup_attempts += 1
             if self.pickup_attempts > MAX_PICKUP_ATTEMPTS:
-                await self.return_arm_home()
+                await self.return_arms_home()
                 self.abort(*ERROR_COULDNT_PICKUP_ITEM)
 
-            await self.gripper_command('open')
+            await self.gripper_command('open', self.gripper_arm())
             self.next_state = 'POSITION_ARM'
             self.set_state('IDLE')
             #self.set_state('PICK_ITEM')
@@ -818,14 +2121,12 @@ class SkillHiveSelection(RayaFSMSkill):
         await self.sleep(1.5)
         if self.tags_detected:
             self.tags_detected = False 
-            self.target = await self.choose_next_target(HIVE_NUM_ROWS, HIVE_NUM_COLS)
-            self.num_detections = self.target['num_detections']
-            self.target_x = self.target['tag'][1][0]
-            self.target_y = self.target['tag'][1][1]
-            self.target_z = self.target['tag'][1][2]
+            self.set_target(
+                    await self.choose_next_target(HIVE_NUM_ROWS, HIVE_NUM_COLS))
             await self.send_feedback(self.target)
             self.set_state('POSITION_ARM')
         
-        elif (time.time() - self.detection_start_time) > NO_TARGET_TIMEOUT:
+        elif (time.time() - self.detection_start_time) > \
+                self.deadline.timeout(NO_TARGET_TIMEOUT):
             self.abort(*ERROR_TAG_NOT_FOUND)
 #--------------------------------- DEBUG ------------------------------------#
@@ -0,0 +1,133 @@
+'''Persistent hive occupancy model shared between picks'''
+
+import json
+import os
+import time
+
+from skills.hive_selection.constants import INVENTORY_MAX_AGE
+
+
+class HiveInventory:
+    '''
+    Per-hive record of the tags seen after the last confirmed pickup, keyed
+    by map and hive and stored as JSON. The visible tags and the next target
+    are stored as absolute cells of the hive board (HiveFrame), counted from
+    the hive origin: the base_link position of the tag of cell (0, 0) when
+    docked to the hive. The origin outlives the records of the hive.
+    '''
+
+    def __init__(self, path):
+        self.path = os.path.expanduser(path)
+        self.records = self.load()
+
+
+    @staticmethod
+    def key(map_name, hive_name):
+        return f'{map_name}/{hive_name}'
+
+
+    def load(self):
+        '''Read the records from disk (empty if missing or corrupted)'''
+        try:
+            with open(self.path, 'r', encoding = 'utf-8') as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return {}
+
+
+    def save(self):
+        '''Atomically write the records to disk'''
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok = True)
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w', encoding = 'utf-8') as file:
+            json.dump(self.records, file, indent = 2)
+        os.replace(tmp_path, self.path)
+
+
+    def get(self, map_name, hive_name):
+        '''Last record of the hive, None if unknown or too old'''
+        record = self.records.get(self.key(map_name, hive_name))
+        if record is None or 'cells' not in record or \
+                time.time() - record['updated'] > INVENTORY_MAX_AGE:
+            return None
+        return record
+
+
+    def origin(self, map_name, hive_name, frame = None):
+        '''
+        Origin of the hive, set to the board origin of `frame` (fitted while
+        docked) if the hive has none yet. None if unknown.
+        '''
+        key = self.key(map_name, hive_name)
+        if 'origin' in self.records.get(key, {}):
+            return self.records[key]['origin']
+        if frame is None:
+            return None
+        origin = list(map(float, frame.translation))
+        self.records.setdefault(key, {})['origin'] = origin
+        self.save()
+        return origin
+
+
+    def record_pickup(self, map_name, hive_name, frame, next_target):
+        '''
+        INPUTS:
+            frame - HiveFrame fitted to the detections after pickup, anchored
+                    to the hive origin (None if it couldn't be)
+            next_target - dict returned by choose_next_target after pickup
+
+        OUTPUTS:
+            Updates and stores the hive record. The record is dropped if
+            there is no board fit or no next target to predict.
+        '''
+        if frame is None or next_target['tag'] is None:
+            self.forget(map_name, hive_name)
+            return
+
+        self.records.setdefault(self.key(map_name, hive_name), {}).update({
+            'cells' : visible_cells(frame, next_target['all_tags']),
+            'tag_poses' : [list(map(float, pose))
+                           for pose in next_target['all_tags']],
+            'num_detections' : next_target['num_detections'],
+            'next_target' : {
+                'cell' : frame.cell_of([next_target['tag'][1]])[0].tolist(),
+                'position' : list(map(float, next_target['tag'][1])),
+                'row' : next_target['row'],
+                'col' : next_target['col'],
+            },
+            'updated' : time.time(),
+        })
+        self.save()
+
+
+    def forget(self, map_name, hive_name):
+        '''
+        Drop the hive record (e.g. after a refill or a bad prediction), keeping
+        the hive origin
+        '''
+        key = self.key(map_name, hive_name)
+        record = self.records.get(key)
+        if record is None or 'cells' not in record:
+            return
+        self.records[key] = {name : value for name, value in record.items()
+                             if name == 'origin'}
+        self.save()
+
+
+    @staticmethod
+    def confirms(record, cells):
+        '''
+        Whether the hive cells seen now are the visible cells after the last
+        pickup, in which case the recorded next cell is still valid
+        '''
+        if record is None or cells is None:
+            return False
+        return record['cells'] == cells
+
+
+
+def visible_cells(frame, points):
+    '''Sorted [row, col] cells of the base_link tag `points`'''
+    if len(points) == 0:
+        return []
+    return sorted(frame.cell_of(points).tolist())
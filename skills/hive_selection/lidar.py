@@ -0,0 +1,255 @@
+'''Lidar scan geometry: sector queries and hive face fitting'''
+
+from functools import lru_cache
+
+import numpy as np
+
+from skills.hive_selection.constants import (LIDAR_RANSAC_ITERATIONS,
+                                             LIDAR_RANSAC_THRESHOLD,
+                                             LIDAR_RANSAC_MIN_INLIERS,
+                                             LIDAR_MIN_RANGE,
+                                             ROBOT_FOOTPRINT,
+                                             SWEPT_PATH_MARGIN)
+
+# Move direction: (unit vector, footprint edge it moves, across axis bounds)
+_SWEPT_DIRECTIONS = {
+    'forward' : ((1.0, 0.0), 'front', ('half_width', 'half_width')),
+    'reverse' : ((-1.0, 0.0), 'back', ('half_width', 'half_width')),
+    'left' : ((0.0, 1.0), 'half_width', ('back', 'front')),
+    'right' : ((0.0, -1.0), 'half_width', ('back', 'front')),
+}
+
+
+class LidarIndex:
+    '''
+    Angle to beam index table of one lidar configuration. Build it through
+    lidar_index() so it is only computed once per configuration.
+    '''
+
+    def __init__(self, angle_min, angle_increment, n_beams):
+        self.angle_min = angle_min
+        self.angle_increment = angle_increment
+        self.n_beams = n_beams
+        angles = angle_min + angle_increment * np.arange(n_beams)
+        self.angles = np.arctan2(np.sin(angles), np.cos(angles))
+        self.cos = np.cos(self.angles)
+        self.sin = np.sin(self.angles)
+        self._sectors = {}
+
+
+    def beam(self, angle):
+        '''Index of the beam closest to `angle` (radians)'''
+        return int(round((angle - self.angle_min) / self.angle_increment)) \
+                    % self.n_beams
+
+
+    def covers(self, center, half_width):
+        '''Whether the sector (degrees) is inside the field of view'''
+        fov = abs(self.angle_increment) * self.n_beams
+        if fov >= 2 * np.pi - abs(self.angle_increment):
+            return True
+        tolerance = abs(self.angle_increment) / 2
+        start = (np.radians(center - half_width) - self.angle_min +
+                 tolerance) % (2 * np.pi) - tolerance
+        return start + np.radians(2 * half_width) <= fov + tolerance
+
+
+
+    def sector(self, center, half_width):
+        '''
+        Slices of the beams within `half_width` of `center` (degrees), two
+        when the sector wraps around the end of the scan
+        '''
+        key = (center, half_width)
+        if key not in self._sectors:
+            first = self.beam(np.radians(center - half_width))
+            n = min(self.n_beams, int(round(
+                    np.radians(2 * half_width) / abs(self.angle_increment))) + 1)
+            last = first + n
+            if last <= self.n_beams:
+                slices = (slice(first, last),)
+            else:
+                slices = (slice(first, self.n_beams),
+                          slice(0, last - self.n_beams))
+            self._sectors[key] = slices
+        return self._sectors[key]
+
+
+
+@lru_cache(maxsize = 8)
+def lidar_index(angle_min, angle_increment, n_beams):
+    '''Cached LidarIndex of a lidar configuration'''
+    return LidarIndex(angle_min, angle_increment, n_beams)
+
+
+
+class LidarScan:
+    '''
+    Sector queries on one scan. The ranges are wrapped in a NumPy array
+    once and sectors are views on it, inf/NaN and too close returns are
+    ignored.
+    '''
+
+    def __init__(self, ranges, angle_min, angle_increment):
+        self.ranges = np.asarray(ranges, dtype = float)
+        self.index = lidar_index(angle_min, angle_increment, len(self.ranges))
+
+
+    def sector(self, center, half_width):
+        '''Views of the ranges within `half_width` of `center` (degrees)'''
+        return [self.ranges[s] for s in self.index.sector(center, half_width)]
+
+
+    def _valid(self, center, half_width):
+        views = self.sector(center, half_width)
+        valid = [view[np.isfinite(view) & (view >= LIDAR_MIN_RANGE)]
+                 for view in views]
+        return np.concatenate(valid) if len(valid) > 1 else valid[0]
+
+
+    def sector_min(self, center = 0.0, half_width = 5.0):
+        '''Closest valid return in the sector, inf if there's none'''
+        valid = self._valid(center, half_width)
+        return float(valid.min()) if valid.size else np.inf
+
+
+    def sector_percentile(self, q, center = 0.0, half_width = 5.0):
+        '''q-th percentile of the valid returns in the sector'''
+        valid = self._valid(center, half_width)
+        return float(np.percentile(valid, q)) if valid.size else np.inf
+
+
+    def clearance(self, center = 0.0, half_width = 5.0):
+        '''Free distance in the sector, None if it can't be measured'''
+        if not self.index.covers(center, half_width):
+            return None
+        views = self.sector(center, half_width)
+        if all(np.all(np.isnan(view)) for view in views):
+            return None
+        return self.sector_min(center, half_width)
+
+
+    def points(self, max_range = np.inf, sector = None):
+        '''
+        INPUTS:
+            max_range - farther (and inf/NaN) returns are dropped
+            sector - optional (center, half_width) to keep (degrees)
+
+        OUTPUTS:
+            (N, 2) array with the x, y of the returns in the lidar frame
+        '''
+        valid = np.isfinite(self.ranges) & (self.ranges >= LIDAR_MIN_RANGE) \
+                    & (self.ranges <= max_range)
+        if sector is not None:
+            in_sector = np.zeros(len(self.ranges), dtype = bool)
+            for s in self.index.sector(*sector):
+                in_sector[s] = True
+            valid &= in_sector
+        return np.stack([self.ranges[valid] * self.index.cos[valid],
+                         self.ranges[valid] * self.index.sin[valid]], axis = 1)
+
+
+
+class FaceLine:
+    '''Line n . p = offset fitted to the hive face, in the lidar frame'''
+
+    def __init__(self, normal, offset, inliers):
+        # Normal pointing away from the robot
+        if offset < 0:
+            normal, offset = -normal, -offset
+        self.normal = normal
+        self.offset = offset
+        self.inliers = inliers
+
+
+    @property
+    def distance(self):
+        '''Perpendicular distance from the lidar to the face (meters)'''
+        return float(self.offset)
+
+
+    @property
+    def yaw(self):
+        '''Rotation that makes the robot face the hive squarely (degrees)'''
+        return float(np.degrees(np.arctan2(self.normal[1], self.normal[0])))
+
+
+
+def fit_face_ransac(points, iterations = LIDAR_RANSAC_ITERATIONS,
+                    threshold = LIDAR_RANSAC_THRESHOLD,
+                    min_inliers = LIDAR_RANSAC_MIN_INLIERS, rng = None):
+    '''
+    Fit a line to the scan points with RANSAC, all hypotheses evaluated at
+    once, then refine it by least squares on the best inlier set.
+
+    OUTPUTS:
+        FaceLine, or None if no line has `min_inliers` inliers
+    '''
+    points = np.asarray(points, dtype = float)
+    if len(points) < max(2, min_inliers):
+        return None
+    rng = np.random.default_rng() if rng is None else rng
+
+    # One line hypothesis per pair of random points
+    pairs = rng.integers(0, len(points), size = (iterations, 2))
+    p1, p2 = points[pairs[:, 0]], points[pairs[:, 1]]
+    direction = p2 - p1
+    normals = np.stack([-direction[:, 1], direction[:, 0]], axis = 1)
+    norms = np.linalg.norm(normals, axis = 1)
+    valid = norms > 1e-6
+    if not np.any(valid):
+        return None
+    normals = normals[valid] / norms[valid, None]
+    offsets = np.sum(normals * p1[valid], axis = 1)
+
+    # Distances of every point to every hypothesis
+    distances = np.abs(points @ normals.T - offsets)
+    inliers = distances < threshold
+    best = np.argmax(inliers.sum(axis = 0))
+    best_inliers = points[inliers[:, best]]
+    if len(best_inliers) < min_inliers:
+        return None
+
+    # Total least squares refinement
+    centroid = best_inliers.mean(axis = 0)
+    _, _, vt = np.linalg.svd(best_inliers - centroid)
+    normal = vt[1]
+    return FaceLine(normal, float(normal @ centroid), len(best_inliers))
+
+
+
+def swept_path_check(scan, distance, direction = 'reverse',
+                     footprint = ROBOT_FOOTPRINT, margin = SWEPT_PATH_MARGIN):
+    '''
+    Check the area the robot footprint sweeps moving `distance` meters in
+    `direction` ('forward', 'reverse', 'left' or 'right') against every
+    return of the scan at once.
+
+    OUTPUTS:
+        (status, free) - status is 'clear', 'blocked' (a return inside the
+        swept area) or 'unverified' (the area is outside the field of view),
+        free is the distance from the footprint edge to the first return in
+        the corridor (inf if none)
+    '''
+    unit, edge, (low, high) = _SWEPT_DIRECTIONS[direction]
+    extent = footprint[edge]
+    across_low = -footprint[low] - margin
+    across_high = footprint[high] + margin
+
+    # Corridor seen from the lidar, between its two near corners
+    center = np.degrees(np.arctan2(unit[1], unit[0]))
+    half_width = np.degrees(max(np.arctan2(-across_low, extent),
+                                np.arctan2(across_high, extent)))
+    if not scan.index.covers(center, half_width):
+        return 'unverified', None
+
+    points = scan.points()
+    along = points @ np.array(unit)
+    across = points @ np.array([-unit[1], unit[0]])
+    ahead = along - extent
+    in_corridor = (across >= across_low) & (across <= across_high) & \
+                  (ahead >= 0)
+    free = float(ahead[in_corridor].min()) if np.any(in_corridor) \
+                else np.inf
+    status = 'blocked' if free <= abs(distance) + margin else 'clear'
+    return status, free
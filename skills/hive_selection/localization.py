@@ -0,0 +1,99 @@
+'''Reuse of the current localization instead of setting the map again'''
+
+import json
+import os
+import time
+
+from skills.hive_selection.constants import (LOCALIZATION_MAX_AGE,
+                                             LOCALIZATION_MIN_CONFIDENCE)
+
+# Keys the navigation status may use for each field
+_LOCALIZED_KEYS = ['localized', 'is_localized']
+_MAP_KEYS = ['map_name', 'current_map', 'map']
+_CONFIDENCE_KEYS = ['localization_confidence', 'confidence', 'score']
+
+
+def _first(status, keys):
+    for key in keys:
+        if key in status:
+            return status[key]
+    return None
+
+
+
+def localization_state(status):
+    '''
+    INPUTS:
+        status - navigation status (dict or object), its fields can be
+                 missing
+
+    OUTPUTS:
+        (localized, map_name, confidence), None for the unknown ones
+    '''
+    if not isinstance(status, dict):
+        status = getattr(status, '__dict__', {}) or {}
+    localized = _first(status, _LOCALIZED_KEYS)
+    confidence = _first(status, _CONFIDENCE_KEYS)
+    try:
+        confidence = None if confidence is None else float(confidence)
+    except (TypeError, ValueError):
+        confidence = None
+    return (None if localized is None else bool(localized),
+            _first(status, _MAP_KEYS), confidence)
+
+
+
+def localization_reusable(status, map_name, record):
+    '''
+    INPUTS:
+        status - navigation status
+        map_name - map the skill needs
+        record - cached localization of `map_name` (None if unknown)
+
+    OUTPUTS:
+        True when the robot is localized on `map_name` with enough
+        confidence. A status without the map name is trusted only if the
+        cache says the last set_map was on `map_name`.
+    '''
+    localized, current_map, confidence = localization_state(status)
+    if not localized:
+        return False
+    if current_map is None and record is None:
+        return False
+    if current_map is not None and current_map != map_name:
+        return False
+    return confidence is None or confidence >= LOCALIZATION_MIN_CONFIDENCE
+
+
+
+class LocalizationCache:
+    '''Last map the robot was localized on, stored as JSON'''
+
+    def __init__(self, path):
+        self.path = os.path.expanduser(path)
+
+
+    def get(self, map_name):
+        '''Last localization on `map_name`, None if other map or too old'''
+        try:
+            with open(self.path, 'r', encoding = 'utf-8') as file:
+                record = json.load(file)
+        except (OSError, ValueError):
+            return None
+        if record.get('map_name') != map_name or \
+                time.time() - record.get('localized_at', 0) > \
+                LOCALIZATION_MAX_AGE:
+            return None
+        return record
+
+
+    def save(self, map_name, position = None):
+        '''Atomically record a localization on `map_name`'''
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok = True)
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w', encoding = 'utf-8') as file:
+            json.dump({'map_name' : map_name,
+                       'localized_at' : time.time(),
+                       'position' : None if position is None
+                                    else list(position)}, file, indent = 2)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,213 @@
+'''In-process pick metrics with a Prometheus text exporter'''
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from collections import defaultdict, deque
+import threading
+import os
+
+from skills.hive_selection.constants import (METRICS_LATENCY_WINDOW,
+                                             METRICS_QUANTILES,
+                                             METRICS_PREFIX)
+
+
+class PickMetrics:
+    '''
+    Counters and latency windows (per state...) kept by
+    SkillHiveSelection.
+
+    Updates only touch dicts and deques under a lock, so they are cheap
+    enough to call on every FSM transition. Quantiles are computed lazily
+    when the metrics are rendered.
+    '''
+
+    def __init__(self, window = METRICS_LATENCY_WINDOW):
+        self._lock = threading.Lock()
+        self._counters = defaultdict(float)
+        self._latencies = defaultdict(lambda: deque(maxlen = window))
+        self._latency_sum = defaultdict(float)
+        self._latency_count = defaultdict(int)
+
+
+    def inc(self, name, value = 1, **labels):
+        '''Increase counter `name` (with optional labels) by `value`'''
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] += value
+
+
+    def observe(self, name, seconds, **labels):
+        '''Record one latency sample of summary `name` (with labels)'''
+        if seconds < 0:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._latencies[key].append(seconds)
+            self._latency_sum[key] += seconds
+            self._latency_count[key] += 1
+
+
+    def observe_state(self, state, seconds):
+        '''Record the time spent in one visit of `state`'''
+        if state is None:
+            return
+        self.observe('state_latency_seconds', seconds, state = state)
+
+
+    def counter(self, name, **labels):
+        '''Current value of a counter'''
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            return self._counters.get(key, 0.0)
+
+
+    def quantiles(self, name, **labels):
+        '''Latency quantiles of the last samples of summary `name`'''
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            samples = sorted(self._latencies.get(key, ()))
+        if not samples:
+            return {}
+        return {q: samples[min(len(samples) - 1, int(q * len(samples)))]
+                for q in METRICS_QUANTILES}
+
+
+    def state_quantiles(self, state):
+        '''Latency quantiles of the last visits of `state`'''
+        return self.quantiles('state_latency_seconds', state = state)
+
+
+    def summary(self):
+        '''Plain dict with every counter and latency summary'''
+        with self._lock:
+            counters = dict(self._counters)
+            latencies = list(self._latencies)
+        summary = {'counters': {}, 'state_latency': {}, 'latency': {}}
+        for (name, labels), value in counters.items():
+            summary['counters'][_summary_key(name, labels)] = value
+        for name, labels in latencies:
+            quantiles = self.quantiles(name, **dict(labels))
+            if name == 'state_latency_seconds':
+                summary['state_latency'][dict(labels)['state']] = quantiles
+            else:
+                summary['latency'][_summary_key(name, labels)] = quantiles
+        return summary
+
+
+    def render(self):
+        '''Render all the metrics in Prometheus text exposition format'''
+        with self._lock:
+            counters = dict(self._counters)
+            latency_sum = dict(self._latency_sum)
+            latency_count = dict(self._latency_count)
+
+        lines = []
+        declared = set()
+        for (name, labels), value in sorted(counters.items()):
+            full_name = f'{METRICS_PREFIX}_{name}'
+            if full_name not in declared:
+                lines.append(f'# TYPE {full_name} counter')
+                declared.add(full_name)
+            lines.append(f'{full_name}{_format_labels(labels)} {value:g}')
+
+        for name, labels in sorted(latency_count):
+            full_name = f'{METRICS_PREFIX}_{name}'
+            if full_name not in declared:
+                lines.append(f'# TYPE {full_name} summary')
+                declared.add(full_name)
+            for q, value in self.quantiles(name, **dict(labels)).items():
+                q_labels = labels + (('quantile', f'{q:g}'),)
+                lines.append(
+                    f'{full_name}{_format_labels(q_labels)} {value:.6f}')
+            key = (name, labels)
+            lines.append(f'{full_name}_sum{_format_labels(labels)} '
+                         f'{latency_sum[key]:.6f}')
+            lines.append(f'{full_name}_count{_format_labels(labels)} '
+                         f'{latency_count[key]}')
+
+        return '\n'.join(lines) + '\n'
+
+
+
+class MetricsExporter:
+    '''Expose a PickMetrics object over local HTTP and/or a text file'''
+
+    def __init__(self, metrics, port = None, textfile = None,
+                 host = '127.0.0.1', log = None):
+        self.metrics = metrics
+        self.port = port
+        self.textfile = textfile
+        self.host = host
+        self.log = log
+        self._server = None
+        self._thread = None
+
+
+    def start(self):
+        '''Start the HTTP server thread (if a port was given)'''
+        if self.port is None or self._server is not None:
+            return
+
+        metrics = self.metrics
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = metrics.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type',
+                                 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self._thread = threading.Thread(target = self._server.serve_forever,
+                                        name = 'hive_selection_metrics',
+                                        daemon = True)
+        self._thread.start()
+
+
+    def write_textfile(self):
+        '''
+        Atomically dump the metrics to the text file (if one was given). A
+        write error is only logged, it must not mask the pick result.
+        '''
+        if not self.textfile:
+            return
+        tmp_path = f'{self.textfile}.tmp'
+        try:
+            with open(tmp_path, 'w', encoding = 'utf-8') as file:
+                file.write(self.metrics.render())
+            os.replace(tmp_path, self.textfile)
+        except OSError as e:
+            if self.log is not None:
+                self.log.warn(f'Couldnt write the metrics file - {e}')
+
+
+    def stop(self):
+        '''Stop the HTTP server and flush the text file'''
+        self.write_textfile()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+            self._thread = None
+
+
+
+def _summary_key(name, labels):
+    label_str = ','.join(f'{k}={v}' for k, v in labels)
+    return f'{name}{{{label_str}}}' if label_str else name
+
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"')
+                     .replace('\n', '\\n')
+               for _, v in labels)
+    return '{' + ','.join(f'{k}="{v}"'
+                          for (k, _), v in zip(labels, escaped)) + '}'
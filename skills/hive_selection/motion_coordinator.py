@@ -0,0 +1,187 @@
+'''Run arm staging and base moves together when it is safe to do so'''
+
+import asyncio
+import time
+
+from skills.hive_selection.constants import CONCURRENT_MOTION_MIN_CLEARANCE
+
+
+def concurrent_motion_safe(base_motion, front_clearance, arm_clear):
+    '''
+    INPUTS:
+        base_motion - kind of base move ('reverse', 'rotate', ...)
+        front_clearance - free distance in front of the robot (meters)
+        arm_clear - whether the arm starts out of the hive, stowed or with
+                    its gripper pulled out of the cell
+
+    OUTPUTS:
+        Whether the arm can be staged while the base performs the move.
+        Forward and lateral moves towards the hive are never overlapped.
+    '''
+    min_clearance = CONCURRENT_MOTION_MIN_CLEARANCE.get(base_motion)
+    if not arm_clear or min_clearance is None or front_clearance is None:
+        return False
+    return front_clearance >= min_clearance
+
+
+
+class MotionCoordinator:
+    '''Overlaps an arm move and a base move when the safety check allows it'''
+
+    def __init__(self, log, enabled = True):
+        self.log = log
+        self.enabled = enabled
+        self.concurrent_runs = 0
+        self.sequential_runs = 0
+
+
+    async def run(self, arm_coro, base_coro, base_motion, front_clearance,
+                  arm_clear = False, arm_first = False, arm_optional = False):
+        '''
+        INPUTS:
+            arm_coro - coroutine moving the arm
+            base_coro - coroutine moving the base
+            base_motion - kind of base move, see concurrent_motion_safe
+            front_clearance - free distance in front of the robot (meters)
+            arm_clear - the arm starts out of the hive, see
+                        concurrent_motion_safe
+            arm_first - order used when the moves have to be sequential
+            arm_optional - the arm move is only a pre-staging, skip it
+                           instead of running it sequentially
+
+        OUTPUTS:
+            Runs both moves, concurrently if it is safe. Re-raises the first
+            error after both moves have stopped.
+        '''
+        start_time = time.time()
+        if self.enabled and concurrent_motion_safe(base_motion,
+                                                   front_clearance, arm_clear):
+            self.concurrent_runs += 1
+            results = await asyncio.gather(arm_coro, base_coro,
+                                           return_exceptions = True)
+            for result in results:
+                if isinstance(result, BaseException):
+                    raise result
+            self.log.debug(f'Arm and base ({base_motion}) moved together in '
+                           f'{time.time() - start_time:.2f}s')
+            return
+
+        if arm_optional:
+            arm_coro.close()
+            await base_coro
+            return
+
+        self.sequential_runs += 1
+        first, second = (arm_coro, base_coro) if arm_first \
+                            else (base_coro, arm_coro)
+        try:
+            await first
+        except BaseException:
+            # The second move is dropped, close it so it is never awaited
+            second.close()
+            raise
+        await second
+
+
+
+class MotionHandle:
+    '''Awaitable completion of one base motion, carrying its final error'''
+
+    def __init__(self, name, task):
+        self.name = name
+        self.task = task
+        self.start_time = time.time()
+        self.reported = False           # Whether its outcome was awaited
+
+
+    def done(self):
+        return self.task.done()
+
+
+    async def wait(self):
+        '''Wait for the motion to stop, returning its error (or None)'''
+        await asyncio.wait({self.task})
+        if self.task.cancelled():
+            return asyncio.CancelledError(f'{self.name} cancelled')
+        return self.task.exception()
+
+
+    async def result(self):
+        '''Wait for the motion to stop, returning its result or raising its
+        error if it failed'''
+        error = await self.wait()
+        self.reported = True
+        if error is not None:
+            raise error
+        return self.task.result()
+
+
+    def __await__(self):
+        return self.result().__await__()
+
+
+
+class BaseMotionTracker:
+    '''
+    Runs every base motion as a task with a completion handle. A new motion
+    waits for the previous one to stop instead of piling up on it, and is
+    only created then, so it plans its speeds from where the robot stopped.
+    '''
+
+    def __init__(self, log):
+        self.log = log
+        self.current = None
+        self.overlaps_prevented = 0
+
+
+    @property
+    def moving(self):
+        return self.current is not None and not self.current.done()
+
+
+    async def wait_done(self):
+        '''
+        Wait for the current motion (if any) to stop. Re-raises its error if
+        nobody awaited it yet, e.g. a motion started without waiting.
+        '''
+        if self.current is None or self.current.reported:
+            return
+        if self.moving:
+            self.overlaps_prevented += 1
+            self.log.debug(f'Waiting for {self.current.name} to finish')
+        try:
+            await self.current.result()
+        except BaseException as e:
+            self.log.error(f'Base motion {self.current.name} failed - {e!r}')
+            raise
+
+
+    async def start(self, name, motion):
+        '''
+        INPUTS:
+            name - name of the motion (for logs)
+            motion - function returning the motion coroutine, called once
+                     the previous motion has stopped
+
+        OUTPUTS:
+            MotionHandle of the started motion
+        '''
+        await self.wait_done()
+        self.current = MotionHandle(name, asyncio.ensure_future(motion()))
+        return self.current
+
+
+    async def run(self, name, motion):
+        '''Start the motion and wait until it stops, returning its result'''
+        return await (await self.start(name, motion))
+
+
+    def reset(self):
+        '''Forget the last motion, its outcome belongs to a finished pick'''
+        self.current = None
+
+
+    async def wait_idle(self):
+        '''Wait for the current motion (if any) to stop, ignoring its error'''
+        if self.current is not None:
+            await self.current.wait()
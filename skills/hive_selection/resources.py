@@ -0,0 +1,191 @@
+'''Reference counted cameras, models and listeners used by the skill'''
+
+import asyncio
+import resource
+import time
+
+
+def process_usage():
+    '''CPU seconds used and max resident memory (MB) of this process'''
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime, usage.ru_maxrss / 1024.0
+
+
+
+class ResourceManager:
+    '''
+    Keeps a reference count per named resource. The resource is acquired
+    (enabled) on its first reference and released (disabled) when the last
+    one is dropped.
+
+    The resources of the next phase can be pre-warmed: acquired in the
+    background while the current phase runs, and handed over to the next
+    phase when it starts. The ones held can also be pinned, to keep them
+    between runs.
+    '''
+
+    def __init__(self, log, sleep = asyncio.sleep):
+        self.log = log
+        self.sleep = sleep
+        self._resources = {}
+        self._phase = []
+        self._pinned = []
+        self._prewarm_task = None
+        self._prewarm_acquiring = False
+        self._prewarmed = []
+
+
+    def register(self, name, acquire, release):
+        '''
+        INPUTS:
+            name - name of the resource
+            acquire - coroutine function enabling the resource
+            release - coroutine function disabling the resource
+        '''
+        self._resources[name] = {
+            'acquire' : acquire,
+            'release' : release,
+            'count' : 0,
+            'since' : None,
+            'cpu_since' : None,
+        }
+
+
+    def held(self):
+        return [name for name, res in self._resources.items()
+                if res['count'] > 0]
+
+
+    def count(self, name):
+        return self._resources[name]['count']
+
+
+    async def acquire(self, name):
+        res = self._resources[name]
+        if res['count'] == 0:
+            self.log.info(f'Acquiring {name}...')
+            await res['acquire']()
+            res['since'] = time.time()
+            res['cpu_since'] = process_usage()[0]
+        res['count'] += 1
+
+
+    async def release(self, name):
+        res = self._resources[name]
+        if res['count'] == 0:
+            return
+        res['count'] -= 1
+        if res['count'] == 0:
+            self.log.info(f'Releasing {name}: {self.cost_str(name)}')
+            try:
+                await res['release']()
+            except Exception as e:
+                self.log.warn(f'Couldnt release {name} - {e}')
+            res['since'] = None
+            res['cpu_since'] = None
+
+
+    async def sync_phase(self, names):
+        '''
+        Hold exactly `names` for the current phase, acquiring the new ones
+        in order before releasing the old ones in reverse order
+        '''
+        await self._settle_prewarm()
+        names = list(names)
+        for name in names:
+            if name not in self._phase:
+                await self.acquire(name)
+        for name in reversed(self._phase):
+            if name not in names:
+                await self.release(name)
+        self._phase = names
+
+        # The phase holds what it needs, drop the pre-warm references
+        prewarmed, self._prewarmed = self._prewarmed, []
+        for name in reversed(prewarmed):
+            await self.release(name)
+
+
+    def prewarm(self, names, delay = 0.0):
+        '''
+        INPUTS:
+            names - resources the next phase will need
+            delay - seconds to wait before acquiring them
+
+        OUTPUTS:
+            Starts acquiring, in the background, the ones not held yet
+        '''
+        if self._prewarm_task is not None and not self._prewarm_task.done():
+            return
+        names = [name for name in names
+                 if self.count(name) == 0 and name not in self._prewarmed]
+        if names:
+            self._prewarm_task = asyncio.ensure_future(
+                                    self._prewarm(names, delay))
+
+
+    async def _prewarm(self, names, delay):
+        await self.sleep(delay)
+        self._prewarm_acquiring = True
+        try:
+            for name in names:
+                self.log.debug(f'Pre-warming {name}...')
+                await self.acquire(name)
+                self._prewarmed.append(name)
+        finally:
+            self._prewarm_acquiring = False
+
+
+    async def _settle_prewarm(self):
+        '''Cancel a pre-warm still waiting, let one acquiring finish'''
+        task, self._prewarm_task = self._prewarm_task, None
+        if task is None:
+            return
+        if not task.done() and not self._prewarm_acquiring:
+            task.cancel()
+        results = await asyncio.gather(task, return_exceptions = True)
+        if isinstance(results[0], Exception):
+            self.log.warn(f'Pre-warm failed - {results[0]}')
+
+
+    async def pin(self):
+        '''Keep what is held now past the current phase, until unpin()'''
+        for name in self.held():
+            if name not in self._pinned:
+                await self.acquire(name)
+                self._pinned.append(name)
+
+
+    async def unpin(self):
+        '''Drop the references taken by pin()'''
+        pinned, self._pinned = self._pinned, []
+        for name in reversed(pinned):
+            await self.release(name)
+
+
+    async def release_all(self):
+        '''Drop the phase references and anything still held'''
+        await self.sync_phase([])
+        self._pinned = []
+        for name in self.held():
+            while self._resources[name]['count'] > 0:
+                await self.release(name)
+
+
+    def cost_str(self, name):
+        '''Time held and process CPU usage while `name` was held'''
+        res = self._resources[name]
+        if res['since'] is None:
+            return 'not held'
+        held_time = time.time() - res['since']
+        cpu_time = process_usage()[0] - res['cpu_since']
+        cpu_percent = 100.0 * cpu_time / held_time if held_time > 0 else 0.0
+        return f'held {held_time:.1f}s, process CPU {cpu_percent:.0f}%'
+
+
+    def report(self):
+        '''Held resources and resident CPU/memory of the process'''
+        cpu_time, max_rss = process_usage()
+        return {'held' : {name: self.cost_str(name) for name in self.held()},
+                'process_cpu_seconds' : round(cpu_time, 2),
+                'process_max_rss_mb' : round(max_rss, 1)}
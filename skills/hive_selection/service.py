@@ -0,0 +1,252 @@
+'''Long-running pick service: runs queued orders on a warm skill'''
+
+from collections import deque
+import asyncio
+import json
+import os
+import time
+import uuid
+
+import numpy as np
+
+from skills.hive_selection.constants import (SERVICE_POLL_INTERVAL,
+                                             SERVICE_LATENCY_WINDOW)
+
+
+class InProcessOrderQueue:
+    '''Orders put by the same process, each with a future for its result'''
+
+    def __init__(self):
+        self._queue = asyncio.Queue()
+
+
+    def put(self, order):
+        '''Queue `order` (dict), returning a future with its outcome'''
+        order = dict(order)
+        order.setdefault('order_id', uuid.uuid4().hex)
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((order, future))
+        return future
+
+
+    async def get(self, timeout = None):
+        '''Next order, None if there's none after `timeout` seconds'''
+        try:
+            order, future = await asyncio.wait_for(self._queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+        order['_future'] = future
+        return order
+
+
+    def complete(self, order, outcome):
+        future = order.pop('_future')
+        if not future.done():
+            future.set_result(outcome)
+
+
+
+class SpoolOrderQueue:
+    '''
+    Orders as JSON files in a spool directory. A file dropped in incoming/
+    is claimed by moving it to processing/ (atomic, so several consumers
+    can share the spool) and its outcome is written to done/ or failed/.
+    Orders left in processing/ by a previous run are queued again.
+    '''
+
+    def __init__(self, path, poll_interval = SERVICE_POLL_INTERVAL):
+        self.path = os.path.expanduser(path)
+        self.poll_interval = poll_interval
+        for folder in ['incoming', 'processing', 'done', 'failed']:
+            os.makedirs(os.path.join(self.path, folder), exist_ok = True)
+        for name in os.listdir(self._folder('processing')):
+            os.replace(os.path.join(self._folder('processing'), name),
+                       os.path.join(self._folder('incoming'), name))
+
+
+    def _folder(self, folder):
+        return os.path.join(self.path, folder)
+
+
+    def put(self, order):
+        '''Write `order` to the spool, returning its id'''
+        order = dict(order)
+        order.setdefault('order_id', f'{time.time():.6f}_{uuid.uuid4().hex[:8]}')
+        tmp_path = os.path.join(self.path, f'.{order["order_id"]}.json')
+        with open(tmp_path, 'w', encoding = 'utf-8') as file:
+            json.dump(order, file)
+        os.replace(tmp_path, os.path.join(self._folder('incoming'),
+                                          f'{order["order_id"]}.json'))
+        return order['order_id']
+
+
+    def _claim(self):
+        for name in sorted(os.listdir(self._folder('incoming'))):
+            if not name.endswith('.json'):
+                continue
+            path = os.path.join(self._folder('processing'), name)
+            try:
+                os.replace(os.path.join(self._folder('incoming'), name), path)
+            except FileNotFoundError:
+                continue        # Claimed by another consumer
+            try:
+                with open(path, 'r', encoding = 'utf-8') as file:
+                    order = json.load(file)
+            except (OSError, ValueError):
+                os.replace(path, os.path.join(self._folder('failed'), name))
+                continue
+            order.setdefault('order_id', name[:-len('.json')])
+            order['_file'] = name
+            return order
+        return None
+
+
+    async def get(self, timeout = None):
+        '''Next order, None if there's none after `timeout` seconds'''
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            order = self._claim()
+            if order is not None:
+                return order
+            if deadline is not None and time.monotonic() >= deadline:
+                return None
+            await asyncio.sleep(self.poll_interval)
+
+
+    def complete(self, order, outcome):
+        name = order.pop('_file')
+        folder = 'done' if outcome['success'] else 'failed'
+        with open(os.path.join(self._folder(folder), name), 'w',
+                  encoding = 'utf-8') as file:
+            json.dump({'order' : order, **outcome}, file, default = str)
+        os.remove(os.path.join(self._folder('processing'), name))
+
+
+
+class PickService:
+    '''
+    Runs the orders of a queue back to back on a skill that was set up
+    once, keeping the throughput it sustains.
+
+    Running every order on the same skill assumes its handler accepts
+    execute_main() again once the previous run has returned, with the FSM
+    starting over from INITIAL_STATE. The skill resets its per-pick state in
+    main(), which the soak harness exercises with thousands of runs on one
+    instance, but the Ra-Ya side of it isn't documented. With
+    `skill_factory`, each order runs on a new skill instead and it's
+    finished after the order, which only relies on the documented
+    setup/main/finish lifecycle (the warm cameras are lost).
+
+    INPUTS:
+        skill - skill handler (execute_main) already set up
+        queue - InProcessOrderQueue or SpoolOrderQueue
+        log - logger
+        execute_args - function building the execute args of an order
+        callback_feedback - feedback callback passed to execute_main
+        skill_factory - optional coroutine function returning a new skill
+                        handler already set up, used for each order
+    '''
+
+    def __init__(self, skill, queue, log, execute_args = None,
+                 callback_feedback = None, skill_factory = None):
+        self.skill = skill
+        self.skill_factory = skill_factory
+        self.queue = queue
+        self.log = log
+        self.execute_args = execute_args or (lambda order: order)
+        self.callback_feedback = callback_feedback
+        self.orders_done = 0
+        self.orders_failed = 0
+        self.latencies = deque(maxlen = SERVICE_LATENCY_WINDOW)
+        self.busy_time = 0.0
+        self.start_time = None
+        self._stop = False
+
+
+    def stop(self):
+        '''Stop after the order being run'''
+        self._stop = True
+
+
+    async def run_order(self, order):
+        '''Run one order, returning its outcome dict'''
+        start = time.monotonic()
+        outcome = {'success' : True, 'result' : None, 'error' : None}
+        skill = None
+        try:
+            if self.skill_factory is not None:
+                skill = await self.skill_factory()
+            kwargs = {}
+            if self.callback_feedback is not None:
+                kwargs['callback_feedback'] = self.callback_feedback
+            # The cameras and models stay enabled between orders, the
+            # skill releases them when it's finished
+            execute_args = {**self.execute_args(order),
+                            'keep_resources' : self.skill_factory is None}
+            outcome['result'] = await (skill or self.skill).execute_main(
+                    execute_args = execute_args, **kwargs)
+        except Exception as e:
+            outcome.update(success = False, error = repr(e))
+        finally:
+            if skill is not None:
+                try:
+                    await skill.execute_finish()
+                except Exception as e:
+                    self.log.warn(f'Couldnt finish the order skill - {e}')
+        outcome['duration'] = time.monotonic() - start
+        return outcome
+
+
+    async def run(self, max_orders = None, idle_timeout = None):
+        '''
+        INPUTS:
+            max_orders - stop after this many orders (None: no limit)
+            idle_timeout - stop after this many seconds without orders
+                           (None: wait forever)
+        '''
+        self.start_time = time.monotonic()
+        n_orders = 0
+        while not self._stop and (max_orders is None or n_orders < max_orders):
+            order = await self.queue.get(timeout = idle_timeout)
+            if order is None:
+                break
+
+            self.log.info(f'Running order {order["order_id"]}...')
+            outcome = await self.run_order(order)
+            self.queue.complete(order, outcome)
+            n_orders += 1
+            self.busy_time += outcome['duration']
+            self.latencies.append(outcome['duration'])
+            if outcome['success']:
+                self.orders_done += 1
+            else:
+                self.orders_failed += 1
+                self.log.warn(f'Order {order["order_id"]} failed - '
+                              f'{outcome["error"]}')
+            self.log.info(f'Service: {self.report()}')
+        return self.report()
+
+
+    def report(self):
+        '''Orders run, their latency and the throughput sustained'''
+        elapsed = time.monotonic() - self.start_time if self.start_time \
+                    else 0.0
+        n_orders = self.orders_done + self.orders_failed
+        latencies = np.array(self.latencies) if self.latencies else None
+        return {
+            'orders_done' : self.orders_done,
+            'orders_failed' : self.orders_failed,
+            'uptime_s' : round(elapsed, 1),
+            'utilization' : round(self.busy_time / elapsed, 3) \
+                                if elapsed > 0 else 0.0,
+            'orders_per_hour' : round(3600.0 * n_orders / elapsed, 2) \
+                                if elapsed > 0 else 0.0,
+            'successful_orders_per_hour' : \
+                round(3600.0 * self.orders_done / elapsed, 2) \
+                    if elapsed > 0 else 0.0,
+            'order_latency_s' : None if latencies is None else {
+                'p50' : round(float(np.percentile(latencies, 50)), 2),
+                'p95' : round(float(np.percentile(latencies, 95)), 2),
+                'max' : round(float(latencies.max()), 2),
+            },
+        }
@@ -0,0 +1,622 @@
+'''
+Soak and throughput harness for SkillHiveSelection.
+
+Runs thousands of picks against a simulated backend (fake controllers and
+a simulated hive) spread over worker processes. Each worker keeps one warm
+skill instance and runs its picks back to back, so slow leaks and latency
+drift show up in the report. Reports can be compared between commits:
+
+    python -m skills.hive_selection.soak --runs 2000 --workers 4 \
+        --output soak_new.json --baseline soak_old.json
+'''
+
+from types import SimpleNamespace
+import multiprocessing
+import tracemalloc
+import argparse
+import asyncio
+import tempfile
+import json
+import math
+import sys
+import os
+import time
+
+import numpy as np
+
+from raya.skills import RayaFSMSkill
+
+from skills.hive_selection.hive_selection import SkillHiveSelection
+from skills.hive_selection.navigation import NAV_POINT_CART
+from skills.hive_selection.constants import (CELL_SIZE_X,
+                                             CELL_SIZE_Y,
+                                             SOAK_TIME_SCALE,
+                                             SOAK_FRAMES_PER_SECOND,
+                                             SOAK_MAX_FRAMES_PER_TICK,
+                                             SOAK_LAG_PERIOD,
+                                             SOAK_REGRESSION_TOLERANCE)
+
+
+###---------------------------- SIMULATED BACKEND ----------------------------###
+
+class SimulatedAbort(Exception):
+    '''Raised by the simulated FSM when the skill aborts'''
+
+    def __init__(self, error_code, error_msg):
+        super().__init__(f'{error_code}: {error_msg}')
+        self.error_code = error_code
+        self.error_msg = error_msg
+
+
+
+class SimulatedLog:
+    '''Log replacement counting the warnings and errors'''
+
+    def __init__(self, verbose = False):
+        self.verbose = verbose
+        self.warnings = 0
+        self.errors = 0
+
+    def _print(self, level, msg):
+        if self.verbose:
+            print(f'[{level}] {msg}')
+
+    def debug(self, msg):
+        self._print('DEBUG', msg)
+
+    def info(self, msg):
+        self._print('INFO', msg)
+
+    def warn(self, msg):
+        self.warnings += 1
+        self._print('WARN', msg)
+
+    warning = warn
+
+    def error(self, msg):
+        self.errors += 1
+        self._print('ERROR', msg)
+
+
+
+class SimulatedHive:
+    '''Hive whose cells show their tag once the item was picked'''
+
+    def __init__(self, tag_id, n_rows = 2, n_cols = 2, rng = None):
+        self.tag_id = tag_id
+        self.n_rows = n_rows
+        self.n_cols = n_cols
+        self.rng = rng or np.random.default_rng()
+        self.refill()
+
+
+    def refill(self):
+        self.visible = 1
+
+
+    @property
+    def empty(self):
+        return self.visible >= self.n_rows * self.n_cols
+
+
+    def pick(self):
+        '''Remove an item, showing the tag of its cell'''
+        self.visible = min(self.visible + 1, self.n_rows * self.n_cols)
+
+
+    def predictions(self):
+        '''Prediction dicts of the visible tags, as the apriltags model'''
+        predictions = []
+        for i in range(self.visible):
+            row, col = divmod(i, self.n_cols)
+            x = 0.55 + CELL_SIZE_X * row + self.rng.normal(0.0, 0.002)
+            y = -0.05 + CELL_SIZE_Y * col + self.rng.normal(0.0, 0.002)
+            z = 0.90 + self.rng.normal(0.0, 0.002)
+            pose = SimpleNamespace(
+                position = SimpleNamespace(x = x, y = y, z = z),
+                orientation = SimpleNamespace(x = 0.0, y = 0.0, z = 0.0,
+                                              w = 1.0))
+            predictions.append({
+                'tag_id' : self.tag_id,
+                'object_center_px' : (240.0 - 400.0 * row, 600.0 + 50.0 * col),
+                'center_point' : (x, y, z),
+                'pose_base_link' : SimpleNamespace(pose = pose),
+                'decision_margin' : 60.0,
+            })
+        return predictions
+
+
+
+class SimulatedBackend:
+    '''Fake Ra-Ya controllers sharing the simulated robot and hive state'''
+
+    def __init__(self, tag_id, time_scale = SOAK_TIME_SCALE, seed = None):
+        self.time_scale = time_scale
+        self.rng = np.random.default_rng(seed)
+        self.hive = SimulatedHive(tag_id, rng = self.rng)
+        self.wall_distance = 1.0
+        self.map_name = None
+        self.moving = False
+        self.arm_positions = {'right_arm' : [0.0, 0.0, 0.0],
+                              'left_arm' : [0.0, 0.0, 0.0]}
+        self.predictors = []
+        self.image = np.zeros((480, 850, 3), dtype = np.uint8)
+        n_beams = 720
+        self.laser_info = {'angle_min' : -math.pi,
+                           'angle_max' : math.pi,
+                           'angle_increment' : 2 * math.pi / n_beams}
+        angles = -math.pi + self.laser_info['angle_increment'] * \
+                    np.arange(n_beams)
+        self._cos = np.cos(angles)
+
+
+    async def wait(self, seconds):
+        await asyncio.sleep(max(0.0, seconds) * self.time_scale)
+
+
+    def tick(self, seconds):
+        '''Deliver the camera frames of `seconds` of simulated time'''
+        n_frames = min(SOAK_MAX_FRAMES_PER_TICK,
+                       max(1, int(seconds * SOAK_FRAMES_PER_SECOND)))
+        for predictor in list(self.predictors):
+            for _ in range(n_frames):
+                predictor.deliver()
+
+
+    # Navigation
+    async def set_map(self, map_name, wait_localization = True, wait = True):
+        await self.wait(2.0)
+        self.map_name = map_name
+
+    async def get_status(self):
+        return {'localized' : self.map_name is not None,
+                'map_name' : self.map_name,
+                'localization_confidence' : 0.9}
+
+    async def navigate_to_position(self, x, y, angle, pos_unit = None,
+                                   ang_unit = None, wait = True):
+        await self.wait(10.0)
+        self.wall_distance = 1.0 + self.rng.normal(0.0, 0.02)
+
+    async def get_position(self, pos_unit = None, ang_unit = None):
+        return [NAV_POINT_CART['x'] + self.rng.normal(0.0, 0.05),
+                NAV_POINT_CART['y'] + self.rng.normal(0.0, 0.05),
+                40.0 + self.rng.normal(0.0, 1.0)]
+
+    async def cancel_navigation(self):
+        pass
+
+
+    # Motion
+    async def move_linear(self, distance, x_velocity, enable_obstacles = True,
+                          wait = True):
+        distance = abs(distance or 0.0)
+        self.wall_distance -= math.copysign(distance, x_velocity)
+        if wait:
+            self.moving = True
+            await self.wait(distance / abs(x_velocity))
+            self.moving = False
+
+    async def rotate(self, angle, angular_speed, wait = True):
+        self.moving = True
+        await self.wait(abs(angle) / abs(angular_speed))
+        self.moving = False
+
+    def is_moving(self):
+        return self.moving
+
+    async def cancel_motion(self):
+        self.moving = False
+
+
+    # Lidar
+    def get_laser_info(self, ang_unit = None):
+        return dict(self.laser_info)
+
+    def get_raw_data(self):
+        with np.errstate(divide = 'ignore'):
+            ranges = np.where(self._cos > 0.05,
+                              self.wall_distance / self._cos, np.inf)
+        ranges += self.rng.normal(0.0, 0.003, len(ranges))
+        return ranges.tolist()
+
+
+    # Cameras
+    async def enable_color_camera(self, camera_name, **kwargs):
+        await self.wait(0.5)
+
+    async def disable_color_camera(self, camera_name):
+        pass
+
+
+    # CV
+    async def enable_model(self, **kwargs):
+        await self.wait(1.0)
+        predictor = SimulatedPredictor(self)
+        self.predictors.append(predictor)
+        return predictor
+
+    async def disable_model(self, model_obj = None, **kwargs):
+        if model_obj in self.predictors:
+            self.predictors.remove(model_obj)
+
+
+    # Arms
+    def _side(self, arm):
+        return -1.0 if arm == 'right_arm' else 1.0
+
+    async def set_pose(self, arm, x, y, z, **kwargs):
+        await self.wait(3.0)
+        self.arm_positions[arm] = [x, y, z]
+
+    async def set_joints_position(self, arm, **kwargs):
+        await self.wait(3.0)
+        self.arm_positions[arm] = [0.25, 0.2 * self._side(arm), 0.8]
+
+    async def set_predefined_pose(self, arm, predefined_pose, **kwargs):
+        await self.wait(3.0)
+        self.arm_positions[arm] = [0.1, 0.25 * self._side(arm), 0.5]
+
+    async def set_joint_position(self, arm, joint, position, wait = True):
+        await self.wait(1.0)
+        self.hive.pick()
+
+    async def get_current_pose(self, arm):
+        return {'position' : list(self.arm_positions[arm]),
+                'orientation' : [0.0, 0.0, 0.0]}
+
+    async def gripper_cmd(self, **kwargs):
+        await self.wait(0.5)
+
+    async def cancel_execution(self, arm = None):
+        pass
+
+    async def is_pose_valid(self, **kwargs):
+        return True
+
+
+
+class SimulatedPredictor:
+    '''Apriltags model handler delivering simulated frames'''
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.callback = None
+
+    async def find_tags(self, tags, callback):
+        pass
+
+    def set_img_detections_callback(self, callback, **kwargs):
+        self.callback = callback
+
+    def get_current_detections(self):
+        return self.backend.hive.predictions()
+
+    def deliver(self):
+        if self.callback is not None:
+            self.callback(self.backend.hive.predictions(), self.backend.image)
+
+
+
+class SimulatedApproachSkill:
+    '''ApproachToTags replacement, stops at the requested distance'''
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.execute_args = {}
+
+    async def execute_setup(self, setup_args):
+        pass
+
+    async def execute_main(self, execute_args, wait = True, **kwargs):
+        self.execute_args = execute_args
+
+    async def wait_main(self):
+        await self.backend.wait(15.0)
+        self.backend.wall_distance = \
+            self.execute_args.get('distance_to_goal', 0.7) + 0.1
+
+    async def execute_finish(self):
+        pass
+
+
+
+class SimulatedFSM(RayaFSMSkill):
+    '''
+    Minimal FSM runner replacing the Ra-Ya one. It goes between
+    SkillHiveSelection and RayaFSMSkill in the MRO, so the skill's calls to
+    super() land here.
+    '''
+
+    def __init__(self, backend, log):
+        self.backend = backend
+        self.log = log
+        self.setup_args = {}
+        self.execute_args = {}
+        self._next_state = None
+        self.feedbacks = 0
+
+
+    async def get_controller(self, name):
+        return self.backend
+
+
+    def register_skill(self, skill):
+        return SimulatedApproachSkill(self.backend)
+
+
+    async def sleep(self, seconds):
+        self.backend.tick(seconds)
+        await self.backend.wait(seconds)
+
+
+    async def send_feedback(self, feedback):
+        self.feedbacks += 1
+
+
+    def set_state(self, state):
+        self._next_state = state
+
+
+    def abort(self, error_code, error_msg):
+        raise SimulatedAbort(error_code, error_msg)
+
+
+    async def execute_setup(self, setup_args):
+        self.setup_args = {**self.DEFAULT_SETUP_ARGS, **setup_args}
+        await self.setup()
+
+
+    async def execute_main(self, execute_args):
+        self.execute_args = {**self.DEFAULT_EXECUTE_ARGS, **execute_args}
+        return await self.main()
+
+
+    async def execute_finish(self):
+        await self.finish()
+
+
+    async def main(self):
+        state = self.INITIAL_STATE
+        self._next_state = None
+        await getattr(self, f'enter_{state}')()
+        while state not in self.END_STATES:
+            await getattr(self, f'transition_from_{state}')()
+            if self._next_state is None:
+                await asyncio.sleep(0)
+                continue
+            state, self._next_state = self._next_state, None
+            enter = getattr(self, f'enter_{state}', None)
+            if enter is not None:
+                await enter()
+
+
+
+class SimulatedHiveSelection(SkillHiveSelection, SimulatedFSM):
+    '''SkillHiveSelection running on the simulated backend'''
+
+
+
+###-------------------------------- WORKERS --------------------------------###
+
+async def _monitor_loop_lag(samples, stop_event):
+    '''Measure how late the event loop wakes up a periodic task'''
+    loop = asyncio.get_running_loop()
+    while not stop_event.is_set():
+        start = loop.time()
+        await asyncio.sleep(SOAK_LAG_PERIOD)
+        samples.append(loop.time() - start - SOAK_LAG_PERIOD)
+
+
+
+async def _run_worker(worker_id, n_runs, time_scale, seed, verbose):
+    tracemalloc.start()
+    log = SimulatedLog(verbose)
+    backend = SimulatedBackend(tag_id = 4, time_scale = time_scale,
+                               seed = seed)
+    skill = SimulatedHiveSelection(backend, log)
+    work_dir = tempfile.mkdtemp(prefix = f'hive_soak_{worker_id}_')
+    await skill.execute_setup({
+        'working_camera_1' : 'sim_camera_1',
+        'working_camera_2' : 'sim_camera_2',
+        'map_name' : 'sim_map',
+        'item_name' : 'bottle',
+        'tag_size' : 0.04,
+        'inventory_path' : os.path.join(work_dir, 'inventory.json'),
+        'localization_path' : os.path.join(work_dir, 'localization.json'),
+        'checkpoint_path' : os.path.join(work_dir, 'checkpoint.json'),
+        'history_path' : os.path.join(work_dir, 'state_history.jsonl'),
+    })
+
+    lag_samples = []
+    stop_event = asyncio.Event()
+    lag_task = asyncio.create_task(_monitor_loop_lag(lag_samples, stop_event))
+
+    runs = []
+    for run in range(n_runs):
+        if backend.hive.empty:
+            backend.hive.refill()
+        start = time.perf_counter()
+        abort_code = None
+        try:
+            await skill.execute_main({'angle_to_goal' : 40.0,
+                                      'identifier' : [4]})
+        except SimulatedAbort as e:
+            abort_code = e.error_code
+        latency = time.perf_counter() - start
+        image = getattr(skill, 'image', None)
+        runs.append({
+            'worker' : worker_id,
+            'run' : run,
+            'latency' : latency,
+            'success' : abort_code is None,
+            'abort_code' : abort_code,
+            'memory_bytes' : tracemalloc.get_traced_memory()[0],
+            'detections_dict' : len(skill.detections_dict),
+            'frame_bytes' : image.nbytes if image is not None else 0,
+        })
+
+    stop_event.set()
+    await lag_task
+    await skill.execute_finish()
+    tracemalloc.stop()
+    return {'runs' : runs,
+            'lag' : lag_samples,
+            'warnings' : log.warnings,
+            'errors' : log.errors}
+
+
+
+def _worker(args):
+    return asyncio.run(_run_worker(*args))
+
+
+
+###-------------------------------- REPORT --------------------------------###
+
+def _percentiles(values, qs = (50, 95, 99)):
+    if len(values) == 0:
+        return {f'p{q}' : None for q in qs}
+    return {f'p{q}' : float(np.percentile(values, q)) for q in qs}
+
+
+
+def _slope(values, per = 100):
+    '''Least-squares growth of `values` per `per` runs'''
+    if len(values) < 2:
+        return 0.0
+    return float(np.polyfit(np.arange(len(values)), values, 1)[0] * per)
+
+
+
+def build_report(results, label = None):
+    '''Aggregate the worker results in a report that can be compared'''
+    runs = [run for result in results for run in result['runs']]
+    latencies = np.array([run['latency'] for run in runs])
+    lag = np.array([sample for result in results for sample in result['lag']])
+
+    # Drift and growth are measured per worker, over its consecutive runs
+    drifts, growths = [], []
+    for result in results:
+        drifts.append(_slope([run['latency'] for run in result['runs']]))
+        growths.append(_slope([run['memory_bytes'] / 1024.0
+                               for run in result['runs']]))
+
+    aborts = {}
+    for run in runs:
+        if run['abort_code'] is not None:
+            aborts[str(run['abort_code'])] = \
+                aborts.get(str(run['abort_code']), 0) + 1
+
+    return {
+        'label' : label,
+        'runs' : len(runs),
+        'workers' : len(results),
+        'success_rate' : float(np.mean([run['success'] for run in runs]))
+                            if runs else 0.0,
+        'aborts' : aborts,
+        'latency_s' : {**_percentiles(latencies),
+                       'max' : float(latencies.max()) if runs else None},
+        'latency_drift_s_per_100_runs' : float(np.mean(drifts)),
+        'memory_growth_kb_per_100_runs' : float(np.mean(growths)),
+        'detections_dict_max' : max((run['detections_dict'] for run in runs),
+                                    default = 0),
+        'frame_bytes_max' : max((run['frame_bytes'] for run in runs),
+                                default = 0),
+        'event_loop_lag_ms' : {key : (value * 1000.0 if value is not None
+                                      else None)
+                               for key, value in {**_percentiles(lag),
+                                   'max' : float(lag.max()) if len(lag)
+                                           else None}.items()},
+        'warnings' : sum(result['warnings'] for result in results),
+        'errors' : sum(result['errors'] for result in results),
+    }
+
+
+
+def compare_reports(report, baseline, tolerance = SOAK_REGRESSION_TOLERANCE):
+    '''
+    OUTPUTS:
+        List of (metric, baseline value, new value) that got worse than the
+        baseline by more than `tolerance` (relative)
+    '''
+    def worse(new, old, higher_is_worse = True):
+        if new is None or old is None:
+            return False
+        if higher_is_worse:
+            return new > old + abs(old) * tolerance + 1e-9
+        return new < old - abs(old) * tolerance - 1e-9
+
+    checks = [
+        ('latency_s.p50', True), ('latency_s.p95', True),
+        ('latency_s.p99', True), ('latency_drift_s_per_100_runs', True),
+        ('memory_growth_kb_per_100_runs', True),
+        ('event_loop_lag_ms.p99', True), ('success_rate', False),
+    ]
+    regressions = []
+    for key, higher_is_worse in checks:
+        new, old = report, baseline
+        for part in key.split('.'):
+            new = new.get(part) if isinstance(new, dict) else None
+            old = old.get(part) if isinstance(old, dict) else None
+        if worse(new, old, higher_is_worse):
+            regressions.append((key, old, new))
+    return regressions
+
+
+
+def run_soak(n_runs, n_workers, time_scale = SOAK_TIME_SCALE, seed = 0,
+             label = None, verbose = False):
+    '''Run `n_runs` picks over `n_workers` processes and build the report'''
+    n_workers = max(1, min(n_workers, n_runs))
+    runs_per_worker = [n_runs // n_workers + (i < n_runs % n_workers)
+                       for i in range(n_workers)]
+    args = [(i, runs_per_worker[i], time_scale, seed + i, verbose)
+            for i in range(n_workers)]
+    if n_workers == 1:
+        results = [_worker(args[0])]
+    else:
+        with multiprocessing.get_context('spawn').Pool(n_workers) as pool:
+            results = pool.map(_worker, args)
+    return build_report(results, label = label)
+
+
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__.split('\n')[1])
+    parser.add_argument('--runs', type = int, default = 1000)
+    parser.add_argument('--workers', type = int,
+                        default = multiprocessing.cpu_count())
+    parser.add_argument('--time-scale', type = float, default = SOAK_TIME_SCALE,
+                        help = 'simulated to real time ratio of the waits')
+    parser.add_argument('--seed', type = int, default = 0)
+    parser.add_argument('--label', type = str, default = None,
+                        help = 'name of the report (e.g. the commit)')
+    parser.add_argument('--output', type = str, default = None)
+    parser.add_argument('--baseline', type = str, default = None,
+                        help = 'report to compare against')
+    parser.add_argument('--tolerance', type = float,
+                        default = SOAK_REGRESSION_TOLERANCE)
+    parser.add_argument('--verbose', action = 'store_true')
+    args = parser.parse_args()
+
+    report = run_soak(args.runs, args.workers, args.time_scale, args.seed,
+                      args.label, args.verbose)
+    print(json.dumps(report, indent = 2))
+    if args.output:
+        with open(args.output, 'w', encoding = 'utf-8') as file:
+            json.dump(report, file, indent = 2)
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding = 'utf-8') as file:
+            baseline = json.load(file)
+        regressions = compare_reports(report, baseline, args.tolerance)
+        for key, old, new in regressions:
+            print(f'REGRESSION {key}: {old} -> {new}')
+        if regressions:
+            sys.exit(1)
+
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+'''History of the state durations of past picks, to learn their timeouts'''
+
+from collections import deque
+import json
+import os
+
+import numpy as np
+
+from skills.hive_selection.constants import (HISTORY_MAX_RECORDS,
+                                             HISTORY_MIN_SAMPLES,
+                                             HISTORY_TIMEOUT_PERCENTILE,
+                                             HISTORY_TIMEOUT_MARGIN,
+                                             HISTORY_TIMEOUT_MIN,
+                                             HISTORY_TIMEOUT_MAX_FACTOR,
+                                             STATE_MIN_DURATIONS)
+
+
+class StateHistory:
+    '''
+    One JSON line per pick with its hive, item, outcome and the time spent
+    in each state. The last HISTORY_MAX_RECORDS picks are kept in memory and
+    the file is compacted to them when it's loaded.
+    '''
+
+    def __init__(self, path, max_records = HISTORY_MAX_RECORDS):
+        self.path = os.path.expanduser(path)
+        self.max_records = max_records
+        self.records = deque(maxlen = max_records)
+        self._load()
+
+
+    def _load(self):
+        try:
+            with open(self.path, 'r', encoding = 'utf-8') as file:
+                lines = file.readlines()
+        except OSError:
+            return
+        for line in lines:
+            try:
+                self.records.append(json.loads(line))
+            except ValueError:
+                continue
+        if len(lines) > self.max_records:
+            tmp_path = f'{self.path}.tmp'
+            with open(tmp_path, 'w', encoding = 'utf-8') as file:
+                for record in self.records:
+                    file.write(json.dumps(record) + '\n')
+            os.replace(tmp_path, self.path)
+
+
+    def append(self, record):
+        '''Append the `record` of one pick'''
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok = True)
+        with open(self.path, 'a', encoding = 'utf-8') as file:
+            file.write(json.dumps(record) + '\n')
+        self.records.append(record)
+
+
+    def durations(self, state, hive_name, item_name):
+        '''
+        Time spent in each visit of `state`, from its entry, by the
+        successful picks of hive and item. Records with a single total per
+        state (older format) are skipped.
+        '''
+        samples = []
+        for record in self.records:
+            visits = record.get('durations', {}).get(state)
+            if record.get('success') and \
+                    record.get('hive_name') == hive_name and \
+                    record.get('item_name') == item_name and \
+                    isinstance(visits, list):
+                samples.extend(visits)
+        return samples
+
+
+    def timeout(self, state, hive_name, item_name, default):
+        '''
+        INPUTS:
+            state - FSM state
+            hive_name, item_name - pick the timeout is for
+            default - fixed timeout of the state (seconds), None if it has
+                      no limit
+
+        OUTPUTS:
+            HISTORY_TIMEOUT_PERCENTILE of the successful visits of `state`
+            with a HISTORY_TIMEOUT_MARGIN, at least HISTORY_TIMEOUT_MIN and
+            the STATE_MIN_DURATIONS of `state`, and at most
+            HISTORY_TIMEOUT_MAX_FACTOR times `default`. `default` while there
+            are less than HISTORY_MIN_SAMPLES of those visits.
+        '''
+        samples = self.durations(state, hive_name, item_name)
+        if len(samples) < HISTORY_MIN_SAMPLES:
+            return default
+        learned = float(np.percentile(samples, HISTORY_TIMEOUT_PERCENTILE)) * \
+                    HISTORY_TIMEOUT_MARGIN
+        if default is not None:
+            learned = min(learned, default * HISTORY_TIMEOUT_MAX_FACTOR)
+        return max(learned, HISTORY_TIMEOUT_MIN,
+                   STATE_MIN_DURATIONS.get(state, 0.0))
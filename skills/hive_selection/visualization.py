@@ -0,0 +1,129 @@
+'''Debug visualisation of the detections, drawn off the event loop'''
+
+import queue
+import threading
+import time
+import os
+
+import cv2
+from raya.tools.image import show_image
+
+from skills.hive_selection.constants import (VISUALIZATION_QUEUE_SIZE,
+                                             VISUALIZATION_WINDOW)
+
+
+class DetectionVisualizer:
+    '''
+    Draws detection overlays in a worker thread.
+
+    Frames are handed over through a bounded queue; when the worker falls
+    behind the oldest frame is dropped, so `submit()` never blocks the
+    detections callback. HighGUI isn't thread safe, so the worker only keeps
+    the last drawn frame and `show_pending()` displays it from the loop.
+    '''
+
+    def __init__(self, log, output_dir = None, display = False,
+                 queue_size = VISUALIZATION_QUEUE_SIZE):
+        self.log = log
+        self.output_dir = output_dir
+        self.display = display
+        self.frames_submitted = 0
+        self.frames_dropped = 0
+        self.frames_drawn = 0
+        self._queue = queue.Queue(maxsize = queue_size)
+        self._lock = threading.Lock()
+        self._pending = None            # Last drawn frame not yet displayed
+        self._thread = None
+        self._running = False
+
+
+    def start(self):
+        if self._running:
+            return
+        if self.output_dir:
+            os.makedirs(self.output_dir, exist_ok = True)
+        self._running = True
+        self._thread = threading.Thread(target = self._worker,
+                                        name = 'hive_selection_visualizer',
+                                        daemon = True)
+        self._thread.start()
+
+
+    def stop(self):
+        if not self._running:
+            return
+        self._running = False
+        self._put(None)
+        self._thread.join(timeout = 1.0)
+        self._thread = None
+        if self.display:
+            cv2.destroyWindow(VISUALIZATION_WINDOW)
+        self.log.debug(f'Visualizer: {self.frames_drawn} frames drawn, '
+                       f'{self.frames_dropped} dropped')
+
+
+    def submit(self, image, detections):
+        '''Queue a frame and its detections array, dropping frames if busy'''
+        if not self._running or image is None:
+            return
+        self.frames_submitted += 1
+        self._put((image, detections, time.time()))
+
+
+    def _put(self, item):
+        while True:
+            try:
+                self._queue.put_nowait(item)
+                return
+            except queue.Full:
+                try:
+                    self._queue.get_nowait()
+                    self.frames_dropped += 1
+                except queue.Empty:
+                    pass
+
+
+    def _worker(self):
+        while self._running:
+            item = self._queue.get()
+            if item is None:
+                break
+            image, detections, timestamp = item
+            try:
+                self._output(self.draw(image, detections), timestamp)
+                self.frames_drawn += 1
+            except Exception as e:
+                self.log.warn(f'Visualizer couldnt draw frame - {e}')
+
+
+    def show_pending(self):
+        '''Display the last drawn frame, to be called from the main loop'''
+        with self._lock:
+            image, self._pending = self._pending, None
+        if image is not None:
+            show_image(img = image, title = VISUALIZATION_WINDOW)
+
+
+    @staticmethod
+    def draw(image, detections):
+        '''Copy of `image` with the tag centres, ids and positions drawn'''
+        image = image.copy()
+        for detection in detections:
+            # center_px is (row, col), OpenCV draws at (col, row)
+            v, u = (int(c) for c in detection['center_px'])
+            x, y, z = detection['xyz']
+            cv2.circle(image, (u, v), 6, (0, 255, 0), 2)
+            cv2.putText(image, f"{detection['tag_id']}: "
+                               f"({x:.2f}, {y:.2f}, {z:.2f})",
+                        (u + 8, v - 8), cv2.FONT_HERSHEY_SIMPLEX, 0.45,
+                        (0, 255, 0), 1, cv2.LINE_AA)
+        return image
+
+
+    def _output(self, image, timestamp):
+        if self.output_dir:
+            cv2.imwrite(os.path.join(self.output_dir,
+                                     f'detections_{timestamp:.3f}.jpg'), image)
+        if self.display:
+            with self._lock:
+                self._pending = image
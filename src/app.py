@@ -3,28 +3,25 @@ from raya.controllers import NavigationController
 from raya.skills import RayaSkillHandler
 
 from skills.hive_selection import SkillHiveSelection
+from skills.hive_selection.service import PickService, SpoolOrderQueue
 
 # ------------------------------- Application ------------------------------- #
 class RayaApplication(RayaApplicationBase):
 
     async def setup(self):
-        self.hive_selection = self.register_skill(SkillHiveSelection)
-        await self.hive_selection.execute_setup(
-            setup_args = {
-                'working_camera_1' : self.camera_1,
-                'working_camera_2' : self.camera_2,
-                'map_name' : self.map_name,
-                'item_name' : self.item_name,
-                'tag_size' : self.tag_size
-            }
-        )
+        self.hive_selection = await self.new_skill()
 
+        # Tag ApproachToTags approaches for each item, not the cell tags
         self.item_dict = {'bottle' : 4,
                           'towel' : 2}
         self.log.debug(f'IDENTIFIER: [{self.item_dict[self.item_name]}]')
 
 
     async def main(self):
+        if self.service_spool:
+            await self.run_service()
+            return
+
         execute_results = await self.hive_selection.execute_main(
             execute_args = {
                 'angle_to_goal' : self.angle_to_goal,
@@ -43,6 +40,49 @@ class RayaApplication(RayaApplicationBase):
     async def cb_feedback(self, feedback):
         self.log.debug(feedback)
 
+    async def new_skill(self):
+        '''Register and set up a hive selection skill'''
+        skill = self.register_skill(SkillHiveSelection)
+        await skill.execute_setup(
+            setup_args = {
+                'working_camera_1' : self.camera_1,
+                'working_camera_2' : self.camera_2,
+                'map_name' : self.map_name,
+                'item_name' : self.item_name,
+                'tag_size' : self.tag_size
+            }
+        )
+        return skill
+
+    async def run_service(self):
+        '''
+        Run the orders of the spool on the skill set up once, or on a new
+        skill per order with --fresh_skill
+        '''
+        self.log.info(f'Pick service, orders from {self.service_spool}')
+        service = PickService(self.hive_selection,
+                              SpoolOrderQueue(self.service_spool),
+                              self.log,
+                              execute_args = self.order_execute_args,
+                              callback_feedback = self.cb_feedback,
+                              skill_factory = self.new_skill \
+                                    if self.fresh_skill else None)
+        report = await service.run(max_orders = self.max_orders or None)
+        self.log.info(f'Pick service report: {report}')
+
+    def order_execute_args(self, order):
+        '''Execute args of an order, the command line ones by default'''
+        item_name = order.get('item_name', self.item_name)
+        return {
+            'angle_to_goal' : order.get('angle_to_goal', self.angle_to_goal),
+            'identifier' : order.get('identifier',
+                                     [self.item_dict[item_name]]),
+            'item_name' : item_name,
+            **{key : order[key] for key in ['distance_to_goal',
+                                            'pick_deadline']
+               if key in order}
+        }
+
     def get_arguments(self):
         self.camera_1 = self.get_argument('-c1', '--camera1', 
                 type = str, 
@@ -82,3 +122,23 @@ class RayaApplication(RayaApplicationBase):
             help = 'tag size in meters'
         )
 
+        self.service_spool = self.get_argument('-s', '--service',
+                type = str,
+                default = '',
+                required = False,
+                help = 'run as a service, taking the orders (JSON files) '
+                       'from this spool directory')
+
+        self.max_orders = self.get_argument('-n', '--max_orders',
+                type = int,
+                default = 0,
+                required = False,
+                help = 'service: stop after this many orders (0: no limit)')
+
+        self.fresh_skill = self.get_argument('-f', '--fresh_skill',
+                type = int,
+                default = 0,
+                required = False,
+                help = 'service: 1 to set up a new skill for each order '
+                       'instead of running them all on the same one')
+